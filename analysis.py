@@ -0,0 +1,99 @@
+import argparse
+import json
+
+from series import COLUMNS, HOLDER, read_series
+
+MEALS = COLUMNS.index('meals')
+DEADLOCKS = COLUMNS.index('deadlocks')
+SENT = COLUMNS.index('messagesSent')
+STATE = len(COLUMNS)
+
+
+# Counters restart from zero when a philosopher takes over a dead seat, so a drop counts as a fresh start.
+def increase(previous, current):
+    if previous is None or current < previous:
+        return current
+    return current - previous
+
+
+def jain_index(values):
+    squares = sum(v * v for v in values)
+    if len(values) == 0 or squares == 0:
+        return None
+    return sum(values) ** 2 / (len(values) * squares)
+
+
+def analyse(path, starvation=1.0):
+    seats, ticks = read_series(path)
+    totals = [[0] * len(COLUMNS) for _ in range(seats)]
+    previous = [None] * seats
+    last_meal = [None] * seats
+    longest = [0.0] * seats
+    intervals = []
+    handoffs = 0
+    holders = None
+
+    for elapsed, rows in ticks:
+        current = set()
+        for seat, row in enumerate(rows):
+            if row is None:
+                previous[seat] = None
+                last_meal[seat] = None
+                continue
+            gains = [increase(None if previous[seat] is None else previous[seat][i], row[i])
+                     for i in range(len(COLUMNS))]
+            for i, gain in enumerate(gains):
+                totals[seat][i] += gain
+            if last_meal[seat] is None:
+                last_meal[seat] = elapsed
+            hungry = elapsed - last_meal[seat]
+            longest[seat] = max(longest[seat], hungry)
+            if gains[MEALS] > 0:
+                if hungry >= starvation:
+                    intervals.append([seat, last_meal[seat], elapsed])
+                last_meal[seat] = elapsed
+            previous[seat] = row
+            if row[STATE] == HOLDER:
+                current.add(seat)
+        if holders is not None:
+            handoffs += len(current - holders)
+        holders = current
+
+    end = ticks[-1][0] if len(ticks) > 0 else 0.0
+    for seat in range(seats):
+        if last_meal[seat] is not None and end - last_meal[seat] >= starvation:
+            intervals.append([seat, last_meal[seat], end])
+
+    duration = end
+    meals = [t[MEALS] for t in totals]
+    messages = sum(t[SENT] for t in totals)
+    return {'path': path,
+            'philosophers': seats,
+            'ticks': len(ticks),
+            'duration': duration,
+            'meals': sum(meals),
+            'mealsPerSecond': sum(meals) / duration if duration else None,
+            'mealsPerSeat': meals,
+            'fairness': jain_index(meals),
+            'messagesPerMeal': messages / sum(meals) if sum(meals) else None,
+            'deadlocks': sum(t[DEADLOCKS] for t in totals),
+            'tokenHandoffs': handoffs,
+            'longestStarvation': max(longest) if seats else 0.0,
+            'starvationIntervals': intervals}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="summarise recorded dinners: throughput, Jain's fairness index on "
+                                                 "meals and the intervals philosophers went without eating")
+    parser.add_argument('series', help="time series written by manager.py --record", nargs='+')
+    parser.add_argument('--starvation', help="report every interval of at least this many seconds without a meal",
+                        type=float, default=1.0)
+    parser.add_argument('--output', help="append one JSON line per series to this file", type=str)
+    args = parser.parse_args()
+
+    for path in args.series:
+        line = json.dumps(analyse(path, args.starvation))
+        print(line)
+        if args.output is not None:
+            with open(args.output, 'a') as output:
+                output.write(line + '\n')
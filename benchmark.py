@@ -0,0 +1,138 @@
+import argparse
+import json
+import logging
+from multiprocessing import Queue
+from time import sleep, time
+
+from engine import EventLoop
+from log import add_arguments, configure_from
+from manager import Server
+from philosopher import Philosopher
+from profiler import merge, shares
+from protocol import ENCODINGS
+from transport import TRANSPORTS
+
+logger = logging.getLogger('benchmark')
+
+MODES = {'token': 'TOKEN', 'without-token': 'WITHOUT_TOKEN', 'chandy-misra': 'CHANDY_MISRA'}
+
+
+def merge_histograms(histograms):
+    counts = None
+    for histogram in histograms:
+        snapshot = histogram.snapshot()[0]
+        counts = snapshot if counts is None else [a + b for a, b in zip(counts, snapshot)]
+    return counts
+
+
+def run_dinner(philosophers, mode, min_time, max_time, duration, tokens=1, use_asyncio=False, encoding='binary',
+               transport='tcp', profile=False):
+    loop = None
+    if use_asyncio:
+        loop = EventLoop()
+        loop.start()
+
+    Server.MODE = MODES[mode]
+    Server.TOPOLOGY = 'ring'
+    Server.TOKENS = tokens if mode == 'token' else 1
+    Philosopher.ENCODINGS = [encoding]
+    Philosopher.PROFILE = profile
+
+    backend = TRANSPORTS[transport]()
+    server = Server(Queue(), 0, philosophers, loop, backend)
+    server.start()
+    manager_address = ('127.0.0.1', server.get_port())
+    guests = [Philosopher(manager_address, 0, loop, min_time, max_time, backend) for _ in range(philosophers)]
+    for guest in guests:
+        guest.start()
+
+    while not server.wait_start(Server.WAIT_TIMEOUT):
+        pass
+    sleep(max(0, duration - (time() - server.get_start_time())))
+    elapsed = time() - server.get_start_time()
+
+    server.killme()
+    server.join()
+    results = server.send_kill_signal()
+    server.close()
+    for guest in guests:
+        guest.join()
+
+    if loop is not None:
+        loop.stop()
+
+    meals = sum(r['meals'] for r in results)
+    messages = sum(r['messagesSent'] for r in results)
+    deadlocks = sum(r['deadlocks'] for r in results)
+    histograms = [g.get_metrics().histogram('fork_request_seconds') for g in guests]
+    counts = merge_histograms(histograms)
+    p50 = histograms[0].percentile(0.5, counts)
+    p99 = histograms[0].percentile(0.99, counts)
+    result = {'philosophers': philosophers,
+              'mode': mode,
+              'tokens': Server.TOKENS,
+              'engine': 'asyncio' if use_asyncio else 'thread',
+              'encoding': encoding,
+              'transport': transport,
+              'thinkTime': [min_time, max_time],
+              'duration': elapsed,
+              'meals': meals,
+              'mealsPerSecond': meals / elapsed,
+              'messages': messages,
+              'messagesPerMeal': messages / meals if meals else None,
+              'deadlocks': deadlocks,
+              'deadlocksPerSecond': deadlocks / elapsed,
+              'forkAcquireP50Ms': None if p50 is None else p50 * 1000.0,
+              'forkAcquireP99Ms': None if p99 is None else p99 * 1000.0}
+    if profile:
+        result['time'] = shares(merge([r['profile'] for r in results if 'profile' in r]))
+    return result
+
+
+def parse_think_time(value):
+    min_time, max_time = [int(v) for v in value.split(':')]
+    if not 0 <= min_time <= max_time:
+        raise argparse.ArgumentTypeError('think time must be MIN:MAX milliseconds with MIN <= MAX')
+    return min_time, max_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run headless dinners over a parameter sweep and report "
+                                                 "throughput, message cost, deadlocks and fork latency")
+    parser.add_argument('--philosophers', help="numbers of philosophers to sweep", type=int, nargs='+',
+                        default=[5])
+    parser.add_argument('--modes', help="modes to sweep", nargs='+', choices=sorted(MODES),
+                        default=sorted(MODES))
+    parser.add_argument('--think', help="MIN:MAX thinking and sleeping times in ms to sweep",
+                        type=parse_think_time, nargs='+', default=[(5, 50)])
+    parser.add_argument('--duration', help="seconds each dinner runs", type=float, default=5)
+    parser.add_argument('--tokens', help="number of tokens in token mode", type=int, default=1)
+    parser.add_argument('--asyncio', help="serve every connection from one asyncio event loop", action='store_true')
+    parser.add_argument('--encodings', help="fork traffic encodings to sweep", nargs='+', choices=ENCODINGS,
+                        default=['binary'])
+    parser.add_argument('--transports', help="transports to sweep, memory keeps every message in process",
+                        nargs='+', choices=sorted(TRANSPORTS), default=['tcp'])
+    parser.add_argument('--profile', help="time every phase of the dinner and report the share of time spent in "
+                                          "each", action='store_true')
+    parser.add_argument('--output', help="append one JSON line per dinner to this file", type=str)
+    add_arguments(parser, 'WARNING')
+    args = parser.parse_args()
+    if args.asyncio and 'memory' in args.transports:
+        parser.error('the memory transport runs on the thread engine only')
+    configure_from(args)
+
+    for philosophers in args.philosophers:
+        for mode in args.modes:
+            if mode == 'token' and philosophers < max(3, 2 * args.tokens + 1):
+                logger.warning('Skipping token mode with %s philosophers and %s tokens', philosophers, args.tokens)
+                continue
+            for min_time, max_time in args.think:
+                for encoding in args.encodings:
+                    for transport in args.transports:
+                        result = run_dinner(philosophers, mode, min_time, max_time, args.duration, args.tokens,
+                                            args.asyncio, encoding, transport, args.profile)
+                        line = json.dumps(result)
+                        print(line)
+                        if args.output is not None:
+                            with open(args.output, 'a') as output:
+                                output.write(line + '\n')
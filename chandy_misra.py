@@ -0,0 +1,140 @@
+from threading import Condition
+
+
+class Fork(object):
+    __slots__ = ('held', 'dirty', 'requested', 'asked', 'turn', 'retry', 'answer')
+
+    def __init__(self, held):
+        self.held = held
+        self.dirty = True
+        self.requested = False
+        self.asked = False
+        self.turn = False
+        self.retry = False
+        self.answer = None
+
+
+class HygienicForks(object):
+    def __init__(self, seat, neighbours):
+        self.__condition = Condition()
+        self.__seat = seat
+        self.__eating = False
+        self.__forks = dict((neighbour, Fork(seat < neighbour)) for neighbour in neighbours)
+        self.__early = set()
+
+    def is_eating(self):
+        return self.__eating
+
+    def holding(self):
+        with self.__condition:
+            return dict((neighbour, fork.held) for neighbour, fork in self.__forks.items())
+
+    def add(self, neighbour):
+        with self.__condition:
+            if neighbour not in self.__forks:
+                self.__forks[neighbour] = Fork(self.__seat < neighbour)
+                self.__forks[neighbour].requested = neighbour in self.__early
+                self.__early.discard(neighbour)
+                self.__condition.notify_all()
+
+    def remove(self, neighbour):
+        with self.__condition:
+            self.__forks.pop(neighbour, None)
+            self.__condition.notify_all()
+
+    # Each new request for a fork flips its turn bit, so a request seen again with the same turn is a retry after a
+    # lost answer and gets that answer back, instead of a refusal for a fork already handed over.
+    def request(self, neighbour, turn=None):
+        with self.__condition:
+            fork = self.__forks.get(neighbour)
+            if fork is None:
+                self.__early.add(neighbour)
+                return False
+            if turn is not None and fork.answer is not None and fork.answer[0] == turn:
+                return fork.answer[1]
+            if fork.held and fork.dirty and not self.__eating:
+                fork.held = False
+                fork.requested = False
+                self.__condition.notify_all()
+                granted = True
+            else:
+                fork.requested = True
+                granted = False
+            if turn is not None:
+                fork.answer = (turn, granted)
+            return granted
+
+    def receive(self, neighbour):
+        with self.__condition:
+            fork = self.__forks.get(neighbour)
+            if fork is None:
+                return
+            fork.held = True
+            fork.dirty = False
+            fork.asked = False
+            self.__condition.notify_all()
+
+    # The request may have reached the neighbour, so asking again repeats its turn.
+    def ask_again(self, neighbour):
+        with self.__condition:
+            fork = self.__forks.get(neighbour)
+            if fork is not None:
+                fork.asked = False
+                fork.retry = True
+                self.__condition.notify_all()
+
+    def missing(self):
+        with self.__condition:
+            missing = [neighbour for neighbour, fork in self.__forks.items() if not fork.held and not fork.asked]
+            for neighbour in missing:
+                fork = self.__forks[neighbour]
+                fork.asked = True
+                if not fork.retry:
+                    fork.turn = not fork.turn
+                fork.retry = False
+            return missing
+
+    def turn(self, neighbour):
+        with self.__condition:
+            return self.__forks[neighbour].turn
+
+    def __can_eat(self):
+        return all(fork.held for fork in self.__forks.values())
+
+    def __must_ask(self):
+        return any(not fork.held and not fork.asked for fork in self.__forks.values())
+
+    def acquire(self, timeout=None):
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__can_eat() or self.__must_ask(), timeout)
+            if self.__can_eat():
+                self.__eating = True
+                return True
+            return False
+
+    # Priorities earned before the table changed can close a cycle of clean forks with the new neighbours, so a
+    # reseated philosopher dirties every fork and hands over the ones already asked for.
+    def reset(self):
+        with self.__condition:
+            if self.__eating:
+                return []
+            granted = []
+            for neighbour, fork in self.__forks.items():
+                fork.dirty = True
+                if fork.requested and fork.held:
+                    fork.held = False
+                    fork.requested = False
+                    granted.append(neighbour)
+            return granted
+
+    def release(self):
+        with self.__condition:
+            self.__eating = False
+            deferred = []
+            for neighbour, fork in self.__forks.items():
+                fork.dirty = True
+                if fork.requested and fork.held:
+                    fork.held = False
+                    fork.requested = False
+                    deferred.append(neighbour)
+            return deferred
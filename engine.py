@@ -0,0 +1,98 @@
+import asyncio
+import socket
+from threading import Thread
+
+from protocol import MessageReader, encode_message
+
+
+class EventLoop(Thread):
+    def __init__(self):
+        self.__loop = asyncio.new_event_loop()
+
+        Thread.__init__(self, daemon=True)
+
+    def get_loop(self):
+        return self.__loop
+
+    def run(self):
+        asyncio.set_event_loop(self.__loop)
+        self.__loop.run_forever()
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.__loop)
+
+    def call(self, coroutine, timeout=None):
+        return self.submit(coroutine).result(timeout)
+
+    def call_soon(self, callback, *args):
+        self.__loop.call_soon_threadsafe(callback, *args)
+
+    def stop(self):
+        self.submit(self.__shutdown())
+
+    async def __shutdown(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.__loop.stop()
+
+
+class AsyncChannel(object):
+    def __init__(self, loop, reader, writer, timeout=None):
+        self.__loop = loop
+        self.__reader = reader
+        self.__writer = writer
+        self.__timeout = timeout
+        self.__messages = MessageReader()
+        self.__encoding = 'json'
+
+    def get_peer(self):
+        return self.__writer.get_extra_info('peername')
+
+    def set_encoding(self, encoding):
+        self.__encoding = encoding
+
+    async def send_async(self, data):
+        self.__writer.write(encode_message(data, self.__encoding))
+        await self.__writer.drain()
+
+    async def read_async(self):
+        message = self.__messages.next_message()
+        while message is None:
+            chunk = await self.__reader.read(4096)
+            if not chunk:
+                raise ConnectionError('connection closed by peer')
+            self.__messages.feed(chunk)
+            message = self.__messages.next_message()
+        return message
+
+    def send(self, data):
+        self.__loop.call(self.send_async(data))
+
+    def read(self):
+        try:
+            return self.__loop.call(asyncio.wait_for(self.read_async(), self.__timeout))
+        except asyncio.TimeoutError:
+            raise TimeoutError('no message from {}'.format(self.get_peer()))
+
+    def close(self):
+        self.__loop.call_soon(self.__writer.close)
+
+
+async def open_channel(loop, address, timeout=None, bind=None):
+    local_addr = None if bind is None else (bind, 0)
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(address[0], address[1], local_addr=local_addr),
+                                            timeout)
+    return AsyncChannel(loop, reader, writer, timeout)
+
+
+async def serve(loop, port, handler, bind=None):
+    async def on_connect(reader, writer):
+        try:
+            await handler(AsyncChannel(loop, reader, writer))
+        except asyncio.CancelledError:
+            writer.close()
+
+    return await asyncio.start_server(on_connect, '0.0.0.0' if bind is None else bind, port,
+                                      backlog=socket.SOMAXCONN)
@@ -0,0 +1,88 @@
+import argparse
+import logging
+import os
+import shlex
+import subprocess
+import sys
+from time import sleep
+
+from log import add_arguments, configure_from
+
+logger = logging.getLogger('launcher')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_host(value):
+    bind, _, advertise = value.partition('=')
+    return bind, advertise or bind
+
+
+# Hosts get contiguous batches of seats, the first ones one extra philosopher each when the split is uneven.
+def batches(philosophers, hosts):
+    size, extra = divmod(philosophers, len(hosts))
+    return [(host, size + (1 if i < extra else 0)) for i, host in enumerate(hosts)]
+
+
+def philosopher_command(remote, python, host, manager, port, count, extra):
+    bind, advertise = host
+    script = os.path.join(HERE, 'philosopher.py') if remote is None else 'philosopher.py'
+    command = [python, script, '--manager', manager, '--port', str(port), '--count', str(count),
+               '--bind', bind, '--advertise', advertise] + extra
+    if remote is None:
+        return command
+    return shlex.split(remote.format(host=bind)) + command
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="spread a table of philosophers over several hosts, in one batch "
+                                                 "of seats per host, and optionally run the manager as well")
+    parser.add_argument('--philosophers', help="number of philosophers", type=int, required=True)
+    parser.add_argument('--hosts', help="BIND or BIND=ADVERTISE addresses to host philosophers on, several "
+                                        "loopback addresses stand in for machines locally", type=parse_host,
+                        nargs='+', default=[('127.0.0.1', '127.0.0.1')])
+    parser.add_argument('--port', help="first philosopher port on every host", type=int, default=9000)
+    parser.add_argument('--manager', help="manager address as the hosts dial it, a manager is started here on "
+                                          "its port unless --attach is given", type=str, default='127.0.0.1:8980')
+    parser.add_argument('--attach', help="join a manager that is already running", action='store_true')
+    parser.add_argument('--duration', help="Dinner's max duration for the manager started here", type=int,
+                        default=30)
+    parser.add_argument('--manager-args', help="extra manager.py arguments, e.g. --manager-args='--token'",
+                        type=str, default='')
+    parser.add_argument('--philosopher-args', help="extra philosopher.py arguments for every host, e.g. "
+                                                   "--philosopher-args='--asyncio'", type=str, default='')
+    parser.add_argument('--remote', help="command prefix that runs a command on a host, e.g. 'ssh {host} cd "
+                                         "tp2sd &&', philosophers start locally without it", type=str)
+    parser.add_argument('--python', help="python interpreter on the hosts", type=str, default=sys.executable)
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.philosophers < len(args.hosts):
+        parser.error('{} philosophers cannot fill {} hosts'.format(args.philosophers, len(args.hosts)))
+    configure_from(args)
+
+    manager = None
+    if not args.attach:
+        port = args.manager.split(':')[1]
+        command = [sys.executable, os.path.join(HERE, 'manager.py'), '--port', port,
+                   '--philosophers', str(args.philosophers), '--duration', str(args.duration)]
+        manager = subprocess.Popen(command + shlex.split(args.manager_args))
+        logger.info('Started the manager on port %s', port)
+        sleep(1)
+
+    guests = []
+    for host, count in batches(args.philosophers, args.hosts):
+        command = philosopher_command(args.remote, args.python, host, args.manager, args.port, count,
+                                      shlex.split(args.philosopher_args))
+        logger.info('Seating %s philosophers on %s, advertised as %s', count, host[0], host[1])
+        logger.debug(' '.join(command))
+        guests.append(subprocess.Popen(command))
+
+    try:
+        if manager is not None:
+            manager.wait()
+        for guest in guests:
+            guest.wait()
+    except KeyboardInterrupt:
+        for process in guests + ([] if manager is None else [manager]):
+            process.terminate()
+    logger.info('Every host has left the table')
@@ -0,0 +1,115 @@
+import atexit
+import logging
+import struct
+import sys
+from itertools import count
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from threading import Lock
+from time import monotonic
+
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
+TRACE_RECORD = struct.Struct('!dBHI')
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, every, level=logging.DEBUG):
+        logging.Filter.__init__(self)
+        self.__every = every
+        self.__level = level
+        self.__seen = count()
+
+    def filter(self, record):
+        return record.levelno > self.__level or next(self.__seen) % self.__every == 0
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate, level=logging.INFO):
+        logging.Filter.__init__(self)
+        self.__rate = rate
+        self.__level = level
+        self.__lock = Lock()
+        self.__buckets = {}
+
+    def filter(self, record):
+        if record.levelno > self.__level:
+            return True
+        now = monotonic()
+        with self.__lock:
+            tokens, last = self.__buckets.get(record.msg, (self.__rate, now))
+            tokens = min(self.__rate, tokens + (now - last) * self.__rate)
+            allowed = tokens >= 1
+            self.__buckets[record.msg] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+
+
+class ContextFormatter(logging.Formatter):
+    def __init__(self):
+        logging.Formatter.__init__(self, '{asctime} {levelname:<7} {name}{context} {message}', style='{')
+
+    def format(self, record):
+        port = getattr(record, 'port', None)
+        record.context = '' if port is None else ' port={}'.format(port)
+        return logging.Formatter.format(self, record)
+
+
+class BinaryTraceHandler(logging.Handler):
+    def __init__(self, path):
+        logging.Handler.__init__(self)
+        self.__file = open(path, 'ab')
+
+    def emit(self, record):
+        message = record.getMessage().encode('utf-8')
+        port = getattr(record, 'port', None) or 0
+        self.__file.write(TRACE_RECORD.pack(record.created, record.levelno, port, len(message)) + message)
+
+    def close(self):
+        self.__file.close()
+        logging.Handler.close(self)
+
+
+def read_trace(path):
+    with open(path, 'rb') as trace:
+        data = trace.read()
+    offset = 0
+    while offset + TRACE_RECORD.size <= len(data):
+        created, level, port, size = TRACE_RECORD.unpack_from(data, offset)
+        offset += TRACE_RECORD.size
+        yield created, logging.getLevelName(level), port or None, data[offset:offset + size].decode('utf-8')
+        offset += size
+
+
+def add_arguments(parser, level='INFO'):
+    parser.add_argument('--log-level', help="lowest level written to the console", choices=LEVELS, default=level)
+    parser.add_argument('--log-sample', help="keep one of every N debug records", type=int, default=1)
+    parser.add_argument('--log-rate', help="most records per second kept for each message, 0 keeps them all",
+                        type=float, default=0)
+    parser.add_argument('--trace', help="also write every record to this binary trace file", type=str)
+
+
+def configure(level='INFO', sample=1, rate=0, trace_path=None):
+    queue = SimpleQueue()
+    handler = QueueHandler(queue)
+    if sample > 1:
+        handler.addFilter(SamplingFilter(sample))
+    if rate > 0:
+        handler.addFilter(RateLimitFilter(rate))
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(ContextFormatter())
+    console.setLevel(level)
+    handlers = [console]
+    if trace_path is not None:
+        handlers.append(BinaryTraceHandler(trace_path))
+    listener = QueueListener(queue, *handlers, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(logging.DEBUG if trace_path is not None else level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def configure_from(args):
+    return configure(args.log_level, args.log_sample, args.log_rate, args.trace)
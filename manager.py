@@ -1,17 +1,32 @@
-import socket
-import json
 import argparse
-from threading import Thread
+import logging
+from threading import Event, Thread
 from multiprocessing import Queue
-from time import sleep, time
+from queue import Empty, SimpleQueue
+from time import monotonic, sleep, time
+
+from engine import EventLoop, serve
+from log import add_arguments, configure_from
+from profiler import merge, shares, write_folded
+from series import open_series
+from topology import Topology
+from transport import TcpTransport
+
+logger = logging.getLogger('manager')
 
 
 class Connected(Thread):
-    def __init__(self, id, socket, client):
-        self.__socket = socket
+    def __init__(self, id, channel, client):
+        self.__channel = channel
         self.__client = client
-        self.__queue = Queue()
+        self.__responses = SimpleQueue()
+        self.__closed = Event()
+        self.__status = {}
         self.__port = None
+        self.__host = None
+        self.__port_known = Event()
+        self.__killme = Event()
+        self.__last_seen = monotonic()
         self.__id = id
         self.__ready_to_start = False
         self.__pairs = []
@@ -24,212 +39,489 @@ class Connected(Thread):
     def get_id(self):
         return self.__id
 
-    def get_queue(self):
-        return self.__queue
+    def get_host(self):
+        return self.__client[0] if self.__host is None else self.__host
 
     def get_full_address(self):
-        return '{}:{}'.format(self.__client[0], self.__port)
-
-    def is_ready(self):
-        result = self.get_ready_request()
-        while result is None:
-            result = self.get_ready_request()
-        return result
-
-    def get_ready_request(self):
-        data = {'code': 'GET_READY'}
-        self.__socket.send(json.dumps(data).encode('utf-8'))
-        response = json.loads(self.__socket.recv(1024).decode('utf-8'))
+        return '{}:{}'.format(self.get_host(), self.__port)
+
+    def get_status(self):
+        return dict(self.__status)
+
+    def is_responsive(self, timeout):
+        return not self.__closed.is_set() and monotonic() - self.__last_seen < timeout
+
+    def dispatch(self, message):
+        self.__last_seen = monotonic()
+        if message is not None and message.get('code') == 'STATUS_UPDATE':
+            self.__status.update((key, value) for key, value in message.items() if key != 'code')
+        else:
+            self.__responses.put(message)
+
+    def __disconnected(self):
+        self.__closed.set()
+        self.__responses.put(None)
+
+    def post(self, data):
+        if self.__closed.is_set():
+            raise ConnectionError('philosopher {} is disconnected'.format(self.__id))
+        self.__channel.send(data)
+        return True
+
+    def collect(self, deadline):
+        try:
+            response = self.__responses.get(timeout=max(0, deadline - monotonic()))
+        except Empty:
+            raise ConnectionError('philosopher {} did not answer in time'.format(self.__id))
+        if response is None:
+            raise ConnectionError('philosopher {} is disconnected'.format(self.__id))
+        return response
+
+    def read_ready(self, response):
         if response is not None and 'code' in response and response[
             'code'] == 'GET_READY_RESPONSE' and 'ready' in response and response['ready'] is not None:
             return response['ready']
 
         return None
 
-    def get_port_request(self):
-        data = {'code': 'GET_PORT'}
-        self.__socket.send(json.dumps(data).encode('utf-8'))
-        response = json.loads(self.__socket.recv(1024).decode('utf-8'))
+    def read_port(self, response):
         if response is not None and 'code' in response and response[
             'code'] == 'GET_PORT_RESPONSE' and 'port' in response and response['port'] is not None:
             self.__port = response['port']
+            self.__host = response.get('host')
+            self.__port_known.set()
             return True
 
-        return False
+        return None
 
-    def post_pairs_request(self, pairs, first=None):
-        data = {'code': 'POST_PAIRS', 'pairs': pairs, 'mode': Server.MODE}
+    def pairs_message(self, neighbours, pairs, first=None, ahead_busy=False):
+        self.__pairs = pairs
+        data = {'code': 'POST_PAIRS', 'seat': self.__id, 'neighbours': neighbours, 'pairs': pairs, 'mode': Server.MODE,
+                'tokens': Server.TOKENS, 'statusInterval': Server.STATUS_INTERVAL}
         if first is not None:
             data['first'] = first
-        self.__socket.send(json.dumps(data).encode('utf-8'))
-        response = json.loads(self.__socket.recv(1024).decode('utf-8'))
+        if ahead_busy:
+            data['aheadBusy'] = True
+        return data
+
+    def read_pairs(self, response):
         if response is not None and 'code' in response and response['code'] == 'POST_PAIR_RESPONSE':
             self.__ready_to_start = True
             return True
-        return False
+        return None
 
-    def post_begin_request(self):
-        data = {'code': 'POST_BEGIN'}
-        self.__socket.send(json.dumps(data).encode('utf-8'))
-        response = json.loads(self.__socket.recv(1024).decode('utf-8'))
+    def read_begin(self, response):
         if response is not None and 'code' in response and response['code'] == 'BEGIN_RESPONSE':
             self.__ready_to_start = True
+            logger.debug('%s:BEGIN', self.__id)
             return True
-        return False
-
-    def send_pairs(self, pairs, first=None):
-        self.__pairs = pairs
-        while not self.post_pairs_request(pairs, first):
-            pass
-
-    def send_begin(self):
-        while not self.post_begin_request():
-            pass
-        print('{}:BEGIN'.format(self.__id))
-
-    def get_port(self):
-        return self.__port
+        return None
 
-    def get_status_info_request(self):
-        data = {'code': 'GET_STATUS_INFO'}
-        self.__socket.send(json.dumps(data).encode('utf-8'))
-        response = json.loads(self.__socket.recv(1024).decode('utf-8'))
+    def read_status_info(self, response):
         if response is not None and 'code' in response and response[
-            'code'] == 'GET_STATUS_INFO_RESPONSE' and set(response.keys()) == {'code', 'token', 'deadlocks', 'meals',
+            'code'] == 'GET_STATUS_INFO_RESPONSE' and set(response.keys()) >= {'code', 'token', 'deadlocks', 'meals',
                                                                                'messagesSent', 'messagesReceived'}:
             return response
         return None
 
-    def get_status_info(self):
-        count = self.get_status_info_request()
-        while count is None:
-            count = self.get_status_info_request()
-        return count
-
-    def post_kill_signal(self):
-        data = {'code': 'TIME_TO_DIE'}
-        self.__socket.send(json.dumps(data).encode('utf-8'))
-        response = json.loads(self.__socket.recv(1024).decode('utf-8'))
+    def read_kill_signal(self, response):
         if response is not None and 'code' in response and response[
-            'code'] == 'FINALLY_DEAD_RESPONSE' and set(response.keys()) == {'code', 'token', 'deadlocks', 'meals',
+            'code'] == 'FINALLY_DEAD_RESPONSE' and set(response.keys()) >= {'code', 'token', 'deadlocks', 'meals',
                                                                                'messagesSent', 'messagesReceived'}:
             return response
         return None
 
-    def send_kill_signal(self):
-        info = self.post_kill_signal()
-        while info is None:
-            info = self.post_kill_signal()
-        return info
+    def get_port(self):
+        return self.__port
+
+    def wait_port(self, timeout=None):
+        return self.__port_known.wait(timeout)
+
+    def killme(self):
+        self.__killme.set()
+
+    def close(self):
+        self.__killme.set()
+        self.__channel.close()
+
+    def request_port(self):
+        found = None
+        while found is None:
+            self.post({'code': 'GET_PORT'})
+            found = self.read_port(self.collect(monotonic() + Server.HEARTBEAT_TIMEOUT))
+        logger.debug('Philosopher %s listens on port %s', self.__id, self.__port)
 
     def run(self):
-        while not self.get_port_request():
-            pass
-        print(self.__port)
-        while True:
-            if not self.__queue.empty():
-                item = self.__queue.get()
-                self.__socket.send(item.encode('utf-8'))
+        while not self.__killme.is_set():
+            try:
+                message = self.__channel.read()
+            except OSError:
+                break
+            self.dispatch(message)
+        self.__disconnected()
+
+    async def listen_async(self):
+        while not self.__killme.is_set():
+            try:
+                message = await self.__channel.read_async()
+            except OSError:
+                break
+            self.dispatch(message)
+        self.__disconnected()
 
 
 class Server(Thread):
     MODE = ''
-
-    def __init__(self, queue, port, max_connections):
-        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.__socket.bind(("0.0.0.0", port))
-        self.__socket.listen(1)
+    TOPOLOGY = 'ring'
+    TOKENS = 1
+    STATUS_INTERVAL = 0.5
+    HEARTBEAT_TIMEOUT = 3.0
+    WAIT_TIMEOUT = 1.0
+    RECORD = None
+    PROFILE = None
+
+    def __init__(self, queue, port, max_connections, loop=None, transport=None):
+        self.__port = port
+        self.__loop = loop
+        self.__listener = None
+        self.__accepted = SimpleQueue()
+        if loop is None:
+            transport = TcpTransport() if transport is None else transport
+            self.__listener = transport.listen(port, Server.WAIT_TIMEOUT)
+            self.__port = self.__listener.get_port()
+        else:
+            self.__listener = loop.call(serve(loop, port, self.__on_connect))
+            self.__port = self.__listener.sockets[0].getsockname()[1]
         self.__queue = queue
-        self.__killme = False
+        self.__killme = Event()
+        self.__started = Event()
         self.__max_connections = max_connections
+        self.__series = None if Server.RECORD is None else open_series(Server.RECORD, max_connections)
 
         self.__connections = []
-        self.__pairs = {}
+        self.__addresses = []
+        self.__base = None
+        self.__topology = None
+        self.__dead = set()
 
-        print('Initializing on port {}'.format(port))
-        print('Waiting for {} philosophers'.format(max_connections))
+        logger.info('Initializing on port %s', self.__port)
+        logger.info('Waiting for %s philosophers', max_connections)
         self.__stage = 'INIT'
         self.__start_time = None
 
         Thread.__init__(self)
 
     def killme(self):
-        self.__killme = True
+        self.__killme.set()
+
+    def get_port(self):
+        return self.__port
+
+    def close(self):
+        if self.__loop is None:
+            self.__listener.close()
+        else:
+            self.__loop.call_soon(self.__listener.close)
+        if self.__series is not None:
+            self.__series.close()
+
+    def __record(self, statuses):
+        if self.__series is not None and self.__start_time is not None:
+            self.__series.record(time() - self.__start_time, statuses)
 
     def get_start_time(self):
         return self.__start_time
 
-    def calculate_pairs(self):
-        flag = True
-        while flag:
-            for c in self.__connections:
-                flag = (c.get_port() is None)
-
-        for i in range(len(self.__connections)):
-            self.__connections[i].set_id(i)
-            if i == 0:
-                self.__pairs[self.__connections[i].get_full_address()] = [self.__connections[-1].get_full_address(),
-                                   self.__connections[i + 1].get_full_address()]
-            elif i == len(self.__connections) - 1:
-                self.__pairs[self.__connections[i].get_full_address()] = [self.__connections[i - 1].get_full_address(),
-                                   self.__connections[0].get_full_address()]
+    def wait_start(self, timeout=None):
+        return self.__started.wait(timeout)
+
+    async def __on_connect(self, channel):
+        self.__accepted.put((channel, channel.get_peer()))
+
+    def __accept_forever(self):
+        while not self.__killme.is_set():
+            try:
+                accepted = self.__listener.accept()
+            except OSError:
+                break
+            if accepted is not None:
+                self.__accepted.put(accepted)
+
+    def accept(self, timeout=None):
+        try:
+            return self.__accepted.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def __join(self, seat, channel, cliente):
+        connection = Connected(seat, channel, cliente)
+        if self.__loop is None:
+            connection.start()
+        else:
+            self.__loop.submit(connection.listen_async())
+        try:
+            connection.request_port()
+        except OSError as e:
+            logger.warning('Philosopher at %s left before joining, %s', cliente[0], e)
+            connection.close()
+            return None
+        return connection
+
+    def __alive(self):
+        return [c for c in self.__connections if c.get_id() not in self.__dead]
+
+    def __ask(self, connection, request, *args):
+        try:
+            return request(*args)
+        except OSError as e:
+            self.__bury(connection, e)
+            return None
+
+    def __bury(self, connection, reason):
+        if connection.get_id() in self.__dead:
+            return
+        logger.warning('Philosopher %s at seat %s is gone, %s', connection.get_full_address(), connection.get_id(),
+                       reason)
+        self.__dead.add(connection.get_id())
+        connection.close()
+
+    # Every request of a phase goes out before any answer is awaited, so the phase costs about one round trip
+    # whatever the size of the table. The deadline moves on with every answer, so a crowded host is not mistaken
+    # for a dead one, while a silent philosopher holds up the phase for one timeout at most.
+    def __fan_out(self, connections, message, read):
+        results = {}
+        pending = [c for c in connections if c.get_id() not in self.__dead]
+        deadline = monotonic() + Server.HEARTBEAT_TIMEOUT
+        while len(pending) > 0:
+            posted = [c for c in pending if self.__ask(c, c.post, message(c))]
+            pending = []
+            for c in posted:
+                response = self.__ask(c, c.collect, deadline)
+                if response is None:
+                    continue
+                deadline = monotonic() + Server.HEARTBEAT_TIMEOUT
+                result = read(c, response)
+                if result is None:
+                    pending.append(c)
+                else:
+                    results[c.get_id()] = result
+            if monotonic() >= deadline:
+                for c in pending:
+                    self.__bury(c, 'no answer before the deadline')
+                break
+        return results
+
+    def __send_pairs(self, seats):
+        def message(connection):
+            seat = connection.get_id()
+            neighbours = self.__topology.get_neighbours(seat)
+            logger.debug('%s %s - %s', seat, self.__addresses[seat], neighbours)
+            first, ahead_busy = seats[seat]
+            return connection.pairs_message(neighbours, [self.__addresses[n] for n in neighbours], first, ahead_busy)
+
+        self.__fan_out([self.__connections[seat] for seat in sorted(seats)], message, Connected.read_pairs)
+
+    def __send_begin(self, connections):
+        self.__fan_out(connections, lambda c: {'code': 'POST_BEGIN'}, Connected.read_begin)
+
+    def __poll(self):
+        return self.__fan_out(self.__alive(), lambda c: {'code': 'GET_STATUS_INFO'}, Connected.read_status_info)
+
+    def __token_holders(self):
+        return set(seat for seat, info in self.__poll().items() if info['token'][0] or info['token'][1] is not None)
+
+    def __repair(self):
+        while self.__base is not None:
+            topology = self.__base.without(self.__dead)
+            changed = [c.get_id() for c in self.__alive()
+                       if topology.get_neighbours(c.get_id()) != self.__topology.get_neighbours(c.get_id())]
+            self.__topology = topology
+            if len(changed) == 0:
+                return
+            dead = len(self.__dead)
+            holders = set()
+            grants = {}
+            if Server.MODE == 'TOKEN':
+                holders = self.__token_holders()
+                seats = changed + [c.get_id() for c in self.__alive() if c.get_id() not in changed]
+                for seat in seats:
+                    if len(holders) + len(grants) >= Server.TOKENS:
+                        break
+                    neighbours = topology.get_neighbours(seat)
+                    if len(neighbours) == 0 or seat in holders or seat in grants or \
+                            any(n in holders or n in grants for n in neighbours):
+                        continue
+                    logger.warning('Regenerating a lost token at seat %s', seat)
+                    grants[seat] = neighbours[-1]
+            seats = {}
+            for seat in set(changed) | set(grants):
+                neighbours = topology.get_neighbours(seat)
+                ahead_busy = Server.TOKENS > 1 and len(neighbours) > 0 and \
+                    (neighbours[-1] in holders or neighbours[-1] in grants)
+                seats[seat] = (grants.get(seat), ahead_busy)
+            self.__send_pairs(seats)
+            logger.info('Repaired the table around seats %s', changed)
+            if len(self.__dead) == dead:
+                return
+
+    def __admit(self):
+        joined = []
+        accepted = self.accept(0)
+        while accepted is not None:
+            channel, cliente = accepted
+            if len(self.__dead) == 0:
+                logger.warning('Turning away %s, every seat is taken', cliente[0])
+                channel.close()
             else:
-                self.__pairs[self.__connections[i].get_full_address()] = [self.__connections[i - 1].get_full_address(),
-                                   self.__connections[i + 1].get_full_address()]
+                seat = min(self.__dead)
+                connection = self.__join(seat, channel, cliente)
+                if connection is not None:
+                    self.__connections[seat] = connection
+                    self.__addresses[seat] = connection.get_full_address()
+                    self.__dead.discard(seat)
+                    logger.info('Philosopher %s took seat %s', connection.get_full_address(), seat)
+                    joined.append(connection)
+            accepted = self.accept(0)
+        return joined
+
+    def calculate_pairs(self):
+        for c in self.__connections:
+            while not c.wait_port(Server.WAIT_TIMEOUT):
+                pass
+
+        # Seats are dealt out host by host, so ring neighbours mostly share a host and only the seams between
+        # batches cross the network.
+        self.__connections.sort(key=lambda c: c.get_host())
+        for i, connection in enumerate(self.__connections):
+            connection.set_id(i)
+        self.__addresses = [c.get_full_address() for c in self.__connections]
+        self.__base = Topology.parse(Server.TOPOLOGY, len(self.__connections))
+        self.__topology = self.__base.without(self.__dead)
+
+    @staticmethod
+    def token_holders(size, tokens):
+        step = size // tokens
+        return set(i * step for i in range(tokens))
 
     def run(self):
-        while not self.__killme:
-            while len(self.__connections) < self.__max_connections:
-                con, cliente = self.__socket.accept()
-                self.__connections.append(Connected(len(self.__connections), con, cliente))
-                self.__connections[-1].start()
+        if self.__loop is None:
+            Thread(target=self.__accept_forever, daemon=True).start()
+        while not self.__killme.is_set():
+            while len(self.__connections) < self.__max_connections and not self.__killme.is_set():
+                accepted = self.accept(Server.WAIT_TIMEOUT)
+                if accepted is not None:
+                    connection = self.__join(len(self.__connections), *accepted)
+                    if connection is not None:
+                        self.__connections.append(connection)
 
             if len(self.__connections) == self.__max_connections and self.__stage == 'INIT':
-                print('{} philosophers connected, distribuiting pairs.'.format(self.__max_connections))
+                logger.info('%s philosophers connected, distribuiting pairs.', self.__max_connections)
                 self.calculate_pairs()
-                for i, connection in enumerate(self.__connections):
+                holders = Server.token_holders(len(self.__connections), Server.TOKENS)
+                seats = {}
+                for i in range(len(self.__connections)):
+                    neighbours = self.__topology.get_neighbours(i)
                     first = None
-                    if i == 0:
-                        first = self.__pairs[connection.get_full_address()][-1]
-                    print("{} - {}".format(connection.get_full_address(), self.__pairs[connection.get_full_address()]))
-                    connection.send_pairs(self.__pairs[connection.get_full_address()], first)
-
-                print('Waiting all philosophers get ready.')
+                    if i in holders and len(neighbours) > 0:
+                        first = neighbours[-1]
+                    # Only the handshake between several tokens ever clears the flag, so one token never sets it.
+                    ahead_busy = Server.TOKENS > 1 and len(neighbours) > 0 and neighbours[-1] in holders
+                    seats[i] = (first, ahead_busy)
+                self.__send_pairs(seats)
+                self.__repair()
+
+                logger.info('Waiting all philosophers get ready.')
                 self.__stage = 'WAITING_READY'
 
             if self.__stage == 'WAITING_READY':
-                flag = False
-                for c in self.__connections:
-                    flag = c.is_ready()
-                if flag:
+                ready = self.__fan_out(self.__alive(), lambda c: {'code': 'GET_READY'}, Connected.read_ready)
+                if all(ready.get(c.get_id()) is not False for c in self.__alive()):
                     self.__stage = 'READY'
-                    for c in self.__connections:
-                        c.send_begin()
+                    # Nobody is told to begin before everybody is ready, then BEGIN reaches every seat in one burst.
+                    self.__send_begin(self.__alive())
                     self.__start_time = time()
-                    print('Beginning dinner')
+                    self.__started.set()
+                    logger.info('Beginning dinner')
                     self.__stage = 'RUNNING'
 
+                self.__repair()
+
             if self.__stage == 'RUNNING':
-                for c in self.__connections:
-                    info = c.get_status_info()
-                    Server.print_status(c.get_full_address(), info['token'], info['deadlocks'], info['meals'],
-                                        info['messagesSent'], info['messagesReceived'])
-                sleep(0.5)
+                joined = self.__admit()
+                statuses = {}
+                polled = self.__poll() if Server.STATUS_INTERVAL <= 0 else {}
+                for c in self.__alive():
+                    if Server.STATUS_INTERVAL > 0:
+                        if not c.is_responsive(Server.HEARTBEAT_TIMEOUT):
+                            self.__bury(c, 'no heartbeat for {} s'.format(Server.HEARTBEAT_TIMEOUT))
+                            continue
+                        info = c.get_status()
+                    else:
+                        info = polled.get(c.get_id())
+                    if info is None or len(info) == 0:
+                        continue
+                    statuses[c.get_id()] = info
+                    Server.log_status(c.get_full_address(), info['token'], info['deadlocks'], info['meals'],
+                                      info['messagesSent'], info['messagesReceived'], info.get('latency'),
+                                      info.get('profile'))
+                self.__record(statuses)
+                self.__repair()
+                self.__send_begin(joined)
+                Server.log_totals(list(statuses.values()))
+                self.__killme.wait(Server.STATUS_INTERVAL if Server.STATUS_INTERVAL > 0 else 0.5)
 
     @staticmethod
-    def print_status(address, token, deadlocks, meals, messages_sent, messages_received):
-        print('Philosopher {}'.format(address))
-        print('    {}'.format(token))
-        print('    {} deadlocks'.format(deadlocks))
-        print('    {} meals'.format(meals))
-        print('    {} messages sent'.format(messages_sent))
-        print('    {} messages received'.format(messages_received))
+    def log_status(address, token, deadlocks, meals, messages_sent, messages_received, latency=None, profile=None,
+                   level=logging.DEBUG):
+        if not logger.isEnabledFor(level):
+            return
+        lines = ['Philosopher {}'.format(address),
+                 '    {}'.format(token),
+                 '    {} deadlocks'.format(deadlocks),
+                 '    {} meals'.format(meals),
+                 '    {} messages sent'.format(messages_sent),
+                 '    {} messages received'.format(messages_received)]
+        if latency is not None:
+            for name in sorted(latency):
+                summary = latency[name]
+                if summary['count'] > 0:
+                    lines.append('    {}: {} samples, p50 {:.2f} ms, p99 {:.2f} ms'.format(
+                        name, summary['count'], summary['p50'], summary['p99']))
+        if profile is not None:
+            lines.append('    time: {}'.format(Server.format_shares(shares(profile))))
+        logger.log(level, '\n'.join(lines))
+
+    @staticmethod
+    def format_shares(phases):
+        return ', '.join('{} {:.1%}'.format(phase, phases[phase]) for phase in sorted(phases))
+
+    @staticmethod
+    def log_totals(statuses):
+        logger.info('Table: %s philosophers, %s meals, %s deadlocks, %s messages sent', len(statuses),
+                    sum(s['meals'] for s in statuses), sum(s['deadlocks'] for s in statuses),
+                    sum(s['messagesSent'] for s in statuses))
 
     def send_kill_signal(self):
-        for c in self.__connections:
-            result = c.send_kill_signal()
-            Server.print_status(c.get_full_address(), result['token'], result['deadlocks'], result['meals'],
-                                result['messagesSent'], result['messagesReceived'])
+        results = []
+        alive = self.__alive()
+        answers = self.__fan_out(alive, lambda c: {'code': 'TIME_TO_DIE'}, Connected.read_kill_signal)
+        self.__record(answers)
+        for c in alive:
+            result = answers.get(c.get_id())
+            c.killme()
+            if result is None:
+                continue
+            results.append(result)
+            Server.log_status(c.get_full_address(), result['token'], result['deadlocks'], result['meals'],
+                              result['messagesSent'], result['messagesReceived'], result.get('latency'),
+                              result.get('profile'), logging.INFO)
+        profiles = [result['profile'] for result in results if 'profile' in result]
+        if len(profiles) > 0:
+            profile = merge(profiles)
+            logger.info('Table time: %s', Server.format_shares(shares(profile)))
+            if Server.PROFILE is not None:
+                write_folded(Server.PROFILE, profile)
+        return results
 
 
 if __name__ == "__main__":
@@ -238,26 +530,70 @@ if __name__ == "__main__":
                         type=int)
     parser.add_argument('--philosophers', help="number of philosophers", type=int)
     parser.add_argument('--duration', help="Dinner's max duration", type=int)
-    parser.add_argument('--token', help="Token mode", action='store_true')
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument('--token', help="Token mode", action='store_true')
+    parser.add_argument('--tokens', help="number of tokens spaced around the ring in token mode", type=int,
+                        default=1)
+    modes.add_argument('--chandy-misra', help="Chandy-Misra hygienic forks mode", action='store_true')
+    parser.add_argument('--topology', help="ring, grid, grid:ROWSxCOLUMNS or edges:FILE with one 'seat seat' "
+                                           "conflict per line", type=str, default='ring')
+    parser.add_argument('--status-interval', help="seconds between status pushes from each philosopher, "
+                                                  "0 polls every philosopher instead", type=float, default=0.5)
+    parser.add_argument('--heartbeat-timeout', help="seconds of silence after which a philosopher's seat is "
+                                                    "given up, also the deadline for each round of manager requests",
+                        type=float, default=3.0)
+    parser.add_argument('--record', help="write every philosopher's counters at each status tick to this file, "
+                                         "as CSV when it ends in .csv and as a binary series otherwise", type=str)
+    parser.add_argument('--profile', help="write the phase timings of every philosopher running with --profile to "
+                                          "this file as folded stacks for flamegraph.pl when the dinner ends",
+                        type=str)
+    parser.add_argument('--asyncio', help="serve every connection from one asyncio event loop", action='store_true')
+    add_arguments(parser)
     args = parser.parse_args()
     duration = args.duration
 
-    Server.MODE = 'TOKEN' if args.token else 'WITHOUT_TOKEN'
-    print(Server.MODE)
+    Server.MODE = 'TOKEN' if args.token else 'CHANDY_MISRA' if args.chandy_misra else 'WITHOUT_TOKEN'
+    Server.STATUS_INTERVAL = args.status_interval
+    Server.HEARTBEAT_TIMEOUT = args.heartbeat_timeout
+    Server.TOPOLOGY = args.topology
+    Server.TOKENS = args.tokens
+    Server.RECORD = args.record
+    Server.PROFILE = args.profile
+    try:
+        topology = Topology.parse(args.topology, args.philosophers)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.token and not topology.is_ring():
+        parser.error('token mode needs a ring of at least 3 philosophers')
+    if args.tokens < 1 or (args.tokens > 1 and not args.token):
+        parser.error('--tokens needs token mode and at least one token')
+    # At 2K seats every seat either holds a token or sits right behind one, so every pass is refused for good.
+    if args.tokens > 1 and args.philosophers <= 2 * args.tokens:
+        parser.error('{} tokens need at least {} philosophers, so that some token always has a free seat '
+                     'ahead'.format(args.tokens, 2 * args.tokens + 1))
+    configure_from(args)
+    logger.info(Server.MODE)
 
     start_time = time()
 
+    loop = None
+    if args.asyncio:
+        loop = EventLoop()
+        loop.start()
+
     queue = Queue()
-    server = Server(queue, args.port, args.philosophers)
+    server = Server(queue, args.port, args.philosophers, loop)
     server.start()
 
-    while server.get_start_time() is None or ((time() - server.get_start_time()) < duration):
+    while not server.wait_start(Server.WAIT_TIMEOUT):
         pass
+    sleep(max(0, duration - (time() - server.get_start_time())))
 
-    print('Killing everybody\n\n')
-    server.send_kill_signal()
+    logger.info('Killing everybody')
     server.killme()
     server.join()
+    server.send_kill_signal()
+    server.close()
 
 
 
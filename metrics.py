@@ -0,0 +1,147 @@
+from bisect import bisect_left
+from threading import Lock, local
+
+BUCKETS = [0.0001 * 2 ** i for i in range(20)]
+
+
+class Counter(object):
+    def __init__(self):
+        self.__local = local()
+        self.__lock = Lock()
+        self.__cells = []
+
+    def __cell(self):
+        cell = getattr(self.__local, 'cell', None)
+        if cell is None:
+            cell = [0]
+            with self.__lock:
+                self.__cells.append(cell)
+            self.__local.cell = cell
+        return cell
+
+    def increment(self, amount=1):
+        self.__cell()[0] += amount
+
+    def value(self):
+        with self.__lock:
+            return sum(cell[0] for cell in self.__cells)
+
+
+class Histogram(object):
+    def __init__(self, buckets=BUCKETS):
+        self.__buckets = list(buckets)
+        self.__local = local()
+        self.__lock = Lock()
+        self.__cells = []
+
+    def __cell(self):
+        cell = getattr(self.__local, 'cell', None)
+        if cell is None:
+            cell = [[0] * (len(self.__buckets) + 1), 0.0]
+            with self.__lock:
+                self.__cells.append(cell)
+            self.__local.cell = cell
+        return cell
+
+    def get_buckets(self):
+        return self.__buckets
+
+    def observe(self, value):
+        cell = self.__cell()
+        cell[0][bisect_left(self.__buckets, value)] += 1
+        cell[1] += value
+
+    def snapshot(self):
+        counts = [0] * (len(self.__buckets) + 1)
+        total = 0.0
+        with self.__lock:
+            for cell in self.__cells:
+                for i, count in enumerate(cell[0]):
+                    counts[i] += count
+                total += cell[1]
+        return counts, total
+
+    def percentile(self, q, counts=None):
+        if counts is None:
+            counts = self.snapshot()[0]
+        count = sum(counts)
+        if count == 0:
+            return None
+        rank = q * count
+        seen = 0
+        for i, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.__buckets[i] if i < len(self.__buckets) else float('inf')
+        return float('inf')
+
+    def summary(self):
+        counts, total = self.snapshot()
+        count = sum(counts)
+        p50 = self.percentile(0.5, counts)
+        p99 = self.percentile(0.99, counts)
+        return {'count': count,
+                'p50': None if p50 is None else p50 * 1000.0,
+                'p99': None if p99 is None else p99 * 1000.0}
+
+
+class Metrics(object):
+    def __init__(self):
+        self.__counters = {}
+        self.__histograms = {}
+
+    def counter(self, name):
+        if name not in self.__counters:
+            self.__counters[name] = Counter()
+        return self.__counters[name]
+
+    def histogram(self, name):
+        if name not in self.__histograms:
+            self.__histograms[name] = Histogram()
+        return self.__histograms[name]
+
+    def get_counters(self):
+        return dict(self.__counters)
+
+    def get_histograms(self):
+        return dict(self.__histograms)
+
+
+def format_labels(labels, extra=None):
+    items = sorted(labels.items())
+    if extra is not None:
+        items += extra
+    if len(items) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, value) for key, value in items) + '}'
+
+
+def prometheus(entries, prefix='philosopher'):
+    lines = []
+    counters = {}
+    histograms = {}
+    for labels, metrics in entries:
+        for name, counter in metrics.get_counters().items():
+            counters.setdefault(name, []).append((labels, counter))
+        for name, histogram in metrics.get_histograms().items():
+            histograms.setdefault(name, []).append((labels, histogram))
+
+    for name in sorted(counters):
+        metric = '{}_{}_total'.format(prefix, name)
+        lines.append('# TYPE {} counter'.format(metric))
+        for labels, counter in counters[name]:
+            lines.append('{}{} {}'.format(metric, format_labels(labels), counter.value()))
+
+    for name in sorted(histograms):
+        metric = '{}_{}'.format(prefix, name)
+        lines.append('# TYPE {} histogram'.format(metric))
+        for labels, histogram in histograms[name]:
+            counts, total = histogram.snapshot()
+            cumulative = 0
+            for bound, count in zip(histogram.get_buckets() + ['+Inf'], counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(metric, format_labels(labels, [('le', bound)]), cumulative))
+            lines.append('{}_sum{} {}'.format(metric, format_labels(labels), total))
+            lines.append('{}_count{} {}'.format(metric, format_labels(labels), cumulative))
+
+    return '\n'.join(lines) + '\n'
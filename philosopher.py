@@ -1,21 +1,137 @@
 import argparse
-import json
-import socket
-from functools import reduce
-from threading import Thread
-from multiprocessing import Queue
-from random import randint
-from time import sleep
+import asyncio
+import logging
+from threading import Event, Lock, Thread
+from multiprocessing import Process, Queue
+from random import randint, uniform
+from time import perf_counter, sleep
+
+from chandy_misra import HygienicForks
+from engine import EventLoop, open_channel, serve
+from log import add_arguments, configure, configure_from
+from metrics import Metrics, prometheus
+from profiler import NULL_PROFILER, Profiler, merge, write_folded
+from protocol import ENCODINGS, choose_encoding
+from transport import TcpTransport
+
+logger = logging.getLogger('philosopher')
+
+
+class PhilosopherState(object):
+    __slots__ = ('seat', 'mode', 'with_fork', 'lent', 'fork_locks', 'forks', 'token', 'tokens', 'ahead_busy',
+                 'state', 'metrics', 'deadlocks', 'meals', 'time_to_die', 'messages_received', 'messages_sent',
+                 'fork_requests', 'token_passes', 'with_token', 'profiler', 'token_turns', 'token_answers')
+
+    def __init__(self):
+        self.seat = None
+        self.mode = 'TOKEN'
+        self.with_fork = {}
+        self.lent = {}
+        self.fork_locks = {}
+        self.forks = None
+        self.token = (False, None)
+        self.tokens = 1
+        self.ahead_busy = False
+        self.state = 'THINKING'
+        self.metrics = Metrics()
+        self.deadlocks = self.metrics.counter('deadlocks')
+        self.meals = self.metrics.counter('meals')
+        self.time_to_die = False
+        self.messages_received = self.metrics.counter('messages_received')
+        self.messages_sent = self.metrics.counter('messages_sent')
+        self.fork_requests = self.metrics.histogram('fork_request_seconds')
+        self.token_passes = self.metrics.histogram('token_pass_seconds')
+        self.with_token = True
+        self.profiler = NULL_PROFILER
+        self.token_turns = {}
+        self.token_answers = {}
+
+    def status(self, code):
+        status = {'code': code,
+                  'token': self.token,
+                  'deadlocks': self.deadlocks.value(),
+                  'meals': self.meals.value(),
+                  'messagesSent': self.messages_sent.value(),
+                  'messagesReceived': self.messages_received.value(),
+                  'latency': {'forkRequest': self.fork_requests.summary(),
+                              'tokenPass': self.token_passes.summary()}
+                  }
+        profile = self.profiler.snapshot()
+        if profile is not None:
+            status['profile'] = profile
+        return status
+
+    def seat_fork(self, seat):
+        self.with_fork[seat] = False
+        self.lent[seat] = False
+        self.fork_locks[seat] = Lock()
+
+    def drop_fork(self, seat):
+        del self.with_fork[seat]
+        self.lent.pop(seat, None)
+        self.fork_locks.pop(seat, None)
+        self.token_turns.pop(seat, None)
+        self.token_answers.pop(seat, None)
+
+    # Like a fork request, every new pass flips its turn bit, so a pass retried after a lost answer is answered as
+    # before instead of being refused by the token it already delivered, which would leave the sender a copy.
+    def accept_token(self, seat, turn=None):
+        if turn is not None and self.token_answers.get(seat, (None, None))[0] == turn:
+            return self.token_answers[seat][1]
+        accepted = self.token[1] is None and not self.ahead_busy
+        if accepted:
+            self.token = (True, next((neighbour for neighbour in self.with_fork if neighbour != seat), seat))
+        if turn is not None:
+            self.token_answers[seat] = (turn, accepted)
+        return accepted
+
+    # The lower seat of a pair hosts their fork and hands it out under that fork's lock, taking it for itself or
+    # lending it to the neighbour, so at most one of the two holds it at any time.
+    def hosts(self, seat):
+        return self.seat < seat
+
+    def take_fork(self, seat):
+        with self.fork_locks[seat]:
+            if self.lent[seat]:
+                return False
+            self.with_fork[seat] = True
+            return True
+
+    # Lending again to the holder is a grant, which heals a release or an answer lost to a reconnection.
+    def lend_fork(self, seat):
+        lock = self.fork_locks.get(seat)
+        if lock is None or not self.hosts(seat):
+            return False
+        with lock:
+            if self.with_fork.get(seat, False):
+                return False
+            self.lent[seat] = True
+            return True
+
+    def return_fork(self, seat):
+        lock = self.fork_locks.get(seat)
+        if lock is not None:
+            with lock:
+                self.lent[seat] = False
 
 
 class ManagerClient(Thread):
-    def __init__(self, manager_address, port):
-        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def __init__(self, manager_address, port, state, transport=None):
+        self.__state = state
+        self.__transport = TcpTransport() if transport is None else transport
+        self.__channel = None
         self.__killme = False
         self.__port = port
         self.__ready = False
         self.__pairs = None
+        self.__neighbours = None
+        self.__pairs_version = 0
+        self.__pairs_received = Event()
         self.__begin = False
+        self.__begin_received = Event()
+        self.__status_interval = 0
+        self.__last_status = {}
+        self.__pushing = False
         self.__manager_address = manager_address
 
         Thread.__init__(self)
@@ -23,63 +139,142 @@ class ManagerClient(Thread):
     def get_begin(self):
         return self.__begin
 
+    def wait_begin(self, timeout=None):
+        return self.__begin_received.wait(timeout)
+
     def is_ready(self):
         return self.__ready
 
     def get_pairs(self):
         return self.__pairs
 
+    def get_neighbours(self):
+        return self.__neighbours
+
+    def wait_pairs(self, timeout=None):
+        return self.__pairs_received.wait(timeout)
+
+    def get_pairs_version(self):
+        return self.__pairs_version
+
     def set_ready(self, ready):
         self.__ready = ready
 
+    def handle_request(self, request):
+        if request is None or 'code' not in request:
+            return None
+        if request['code'] == 'GET_PORT':
+            response = {'code': 'GET_PORT_RESPONSE', 'port': self.__port}
+            if Philosopher.ADVERTISE is not None:
+                response['host'] = Philosopher.ADVERTISE
+            return response
+        elif request['code'] == 'POST_PAIRS' and 'pairs' in request and 'neighbours' in request and 'mode' in request:
+            self.__state.seat = request['seat']
+            self.__pairs = request['pairs']
+            self.__neighbours = request['neighbours']
+            if 'first' in request:
+                self.__state.token = (True, request['first'])
+            self.__state.tokens = request.get('tokens', 1)
+            self.__state.ahead_busy = request.get('aheadBusy', False)
+
+            self.__state.mode = request['mode']
+            self.__state.with_token = request['mode'] == 'TOKEN'
+            # neighbours get their pairs in the same fan-out and may ask for forks before run() starts
+            if self.__state.mode == 'CHANDY_MISRA' and self.__state.forks is None:
+                self.__state.forks = HygienicForks(self.__state.seat, [])
+            self.__status_interval = request.get('statusInterval', 0)
+            self.__pairs_version += 1
+            self.__pairs_received.set()
+
+            return {'code': 'POST_PAIR_RESPONSE'}
+        elif request['code'] == 'GET_READY':
+            return {'code': 'GET_READY_RESPONSE', 'ready': self.__ready}
+        elif request['code'] == 'POST_BEGIN':
+            self.__begin = True
+            self.__begin_received.set()
+            return {'code': 'BEGIN_RESPONSE'}
+        elif request['code'] == 'GET_STATUS_INFO':
+            return self.__state.status('GET_STATUS_INFO_RESPONSE')
+        elif request['code'] == 'TIME_TO_DIE':
+            self.__state.time_to_die = True
+            return self.__state.status('FINALLY_DEAD_RESPONSE')
+        return None
+
+    def status_update(self):
+        status = self.__state.status('STATUS_UPDATE')
+        update = dict((key, value) for key, value in status.items() if self.__last_status.get(key) != value)
+        self.__last_status = status
+        # An unchanged status still goes out, empty, as the heartbeat the manager watches for.
+        update['code'] = 'STATUS_UPDATE'
+        return update
+
+    def __lose_manager(self):
+        logger.warning('Lost the manager at %s:%s, leaving the table', self.__manager_address[0],
+                       self.__manager_address[1])
+        self.__state.time_to_die = True
+
+    def __start_pushing(self):
+        if self.__pushing or not self.__begin or self.__status_interval <= 0:
+            return False
+        self.__pushing = True
+        return True
+
+    def __push_status(self):
+        while not self.__state.time_to_die:
+            update = self.status_update()
+            if update is not None:
+                try:
+                    self.__channel.send(update)
+                except OSError:
+                    break
+            sleep(self.__status_interval)
+
+    async def __push_status_async(self):
+        while not self.__state.time_to_die:
+            update = self.status_update()
+            if update is not None:
+                try:
+                    await self.__channel.send_async(update)
+                except OSError:
+                    break
+            await asyncio.sleep(self.__status_interval)
+
     def run(self):
-        self.__socket.connect(self.__manager_address)
-        while not Philosopher.TIME_TO_DIE:
-            request = json.loads(self.__socket.recv(1024).decode('utf-8'))
-            if request is not None:
-                if 'code' in request:
-                    if request['code'] == 'GET_PORT':
-                        self.__socket.send(json.dumps({'code': 'GET_PORT_RESPONSE',
-                                                       'port': self.__port}).encode('utf-8'))
-                    elif request['code'] == 'POST_PAIRS' and 'pairs' in request and 'mode' in request:
-                        self.__pairs = request['pairs']
-                        if 'first' in request:
-                            Philosopher.TOKEN = (True, request['first'])
-
-                        Philosopher.WITH_TOKEN = request['mode'] == 'TOKEN'
-
-                        self.__socket.send(json.dumps({'code': 'POST_PAIR_RESPONSE'}).encode('utf-8'))
-                    elif request['code'] == 'GET_READY':
-                        self.__socket.send(
-                            json.dumps({'code': 'GET_READY_RESPONSE', 'ready': self.__ready}).encode('utf-8'))
-                    elif request['code'] == 'POST_BEGIN':
-                        self.__begin = True
-                        self.__socket.send(json.dumps({'code': 'BEGIN_RESPONSE'}).encode('utf-8'))
-                    elif request['code'] == 'GET_STATUS_INFO':
-                        self.__socket.send(json.dumps({'code': 'GET_STATUS_INFO_RESPONSE',
-                                                       'token': Philosopher.TOKEN,
-                                                       'deadlocks': Philosopher.DEADLOCKS,
-                                                       'meals': Philosopher.MEALS,
-                                                       'messagesSent': Philosopher.MESSAGES_SENT,
-                                                       'messagesReceived': Philosopher.MESSAGES_RECEIVED
-                                                       }).encode('utf-8'))
-                    elif request['code'] == 'TIME_TO_DIE':
-                        self.__socket.send(json.dumps({'code': 'FINALLY_DEAD_RESPONSE',
-                                                       'token': Philosopher.TOKEN,
-                                                       'deadlocks': Philosopher.DEADLOCKS,
-                                                       'meals': Philosopher.MEALS,
-                                                       'messagesSent': Philosopher.MESSAGES_SENT,
-                                                       'messagesReceived': Philosopher.MESSAGES_RECEIVED
-                                                       }).encode('utf-8'))
-                        Philosopher.TIME_TO_DIE = True
-
-        self.__socket.close()
+        self.__channel = self.__transport.connect(self.__manager_address)
+        while not self.__state.time_to_die:
+            try:
+                response = self.handle_request(self.__channel.read())
+                if response is not None:
+                    self.__channel.send(response)
+            except OSError:
+                self.__lose_manager()
+                break
+            if self.__start_pushing():
+                Thread(target=self.__push_status, daemon=True).start()
+
+        self.__channel.close()
+
+    async def serve(self, loop):
+        self.__channel = await open_channel(loop, self.__manager_address, bind=Philosopher.BIND)
+        while not self.__state.time_to_die:
+            try:
+                response = self.handle_request(await self.__channel.read_async())
+                if response is not None:
+                    await self.__channel.send_async(response)
+            except OSError:
+                self.__lose_manager()
+                break
+            if self.__start_pushing():
+                loop.submit(self.__push_status_async())
+
+        self.__channel.close()
 
 
 class PhilosopherServerConnection(Thread):
-    def __init__(self, id, socket, client):
+    def __init__(self, id, channel, client, state):
         self.__id = id
-        self.__socket = socket
+        self.__state = state
+        self.__channel = channel
         self.__address = client[0]
         self.__killme = False
 
@@ -88,211 +283,778 @@ class PhilosopherServerConnection(Thread):
     def get_address(self):
         return self.__address
 
+    @staticmethod
+    def handle_request(state, address, request):
+        state.messages_received.increment()
+        if request is not None:
+            if 'code' in request:
+                # print('req {}'.format(request))
+                if request['code'] == 'HELLO':
+                    return {'code': 'HELLO_RESPONSE',
+                            'encoding': choose_encoding(request.get('encodings', []), Philosopher.ENCODINGS)}
+                if request['code'] == 'POST_TOKEN' and 'seat' in request and request['seat'] is not None:
+                    response = {'code': 'POST_TOKEN_RESPONSE',
+                                'accepted': state.accept_token(request['seat'], request.get('turn'))}
+                    state.messages_sent.increment()
+                    return response
+                if request['code'] == 'POST_TOKEN_RELEASED' and 'seat' in request and request['seat'] is not None:
+                    state.ahead_busy = False
+                    response = {'code': 'POST_TOKEN_RELEASED_RESPONSE'}
+                    state.messages_sent.increment()
+                    return response
+                # Fork messages that beat our own pairs go unanswered, the sender's timeout sends them again.
+                if request['code'] in ('REQUEST_FORK', 'POST_FORK') and state.forks is None:
+                    return None
+                if request['code'] == 'REQUEST_FORK' and 'seat' in request and request['seat'] is not None:
+                    response = {'code': 'REQUEST_FORK_RESPONSE',
+                                'granted': state.forks.request(request['seat'], request.get('turn'))}
+                    state.messages_sent.increment()
+                    return response
+                if request['code'] == 'ACQUIRE_FORK' and 'seat' in request and request['seat'] is not None:
+                    response = {'code': 'ACQUIRE_FORK_RESPONSE', 'granted': state.lend_fork(request['seat']),
+                                'state': state.state}
+                    state.messages_sent.increment()
+                    return response
+                # Nobody waits on a release, the next request on the same channel is only read after it.
+                if request['code'] == 'RELEASE_FORK' and 'seat' in request and request['seat'] is not None:
+                    state.return_fork(request['seat'])
+                    return None
+                if request['code'] == 'POST_FORK' and 'seat' in request and request['seat'] is not None:
+                    state.forks.receive(request['seat'])
+                    response = {'code': 'POST_FORK_RESPONSE'}
+                    state.messages_sent.increment()
+                    return response
+        return None
+
     def run(self):
-        while not Philosopher.TIME_TO_DIE:
-            request = json.loads(self.__socket.recv(1024).decode('utf-8'))
-            Philosopher.MESSAGES_RECEIVED += 1
-            if request is not None:
-                if 'code' in request:
-                    # print('req {}'.format(request))
-                    if request['code'] == 'GET_FORK_STATUS' and 'port' in request and request['port'] is not None:
-                        response = {'code': 'GET_FORK_STATUS_RESPONSE',
-                                    'withFork': Philosopher.WITH_FORK['{}:{}'.format(self.__address, request['port'])],
-                                    'state': Philosopher.STATE}
-                        Philosopher.MESSAGES_SENT += 1
-                        self.__socket.send(json.dumps(response).encode('utf-8'))
-                    if request['code'] == 'POST_TOKEN' and 'port' in request and request['port'] is not None:
-                        plist = list(Philosopher.WITH_FORK.keys())
-                        plist.remove('{}:{}'.format(self.__address, request['port']))
-                        destination = plist[0]
-                        Philosopher.TOKEN = (True, destination)
-                        response = {'code': 'POST_TOKEN_RESPONSE'}
-                        Philosopher.MESSAGES_SENT += 1
-                        self.__socket.send(json.dumps(response).encode('utf-8'))
-
-        self.__socket.close()
+        while not self.__state.time_to_die:
+            try:
+                request = self.__channel.read()
+            except ConnectionError:
+                break
+            response = PhilosopherServerConnection.handle_request(self.__state, self.__address, request)
+            if response is not None:
+                self.__channel.send(response)
+                if response['code'] == 'HELLO_RESPONSE':
+                    self.__channel.set_encoding(response['encoding'])
+
+        self.__channel.close()
 
 
 class PhilosopherServer(Thread):
-    def __init__(self, port):
-        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.__socket.bind(("0.0.0.0", port))
-        self.__socket.listen(1)
+    def __init__(self, port, state, loop=None, transport=None):
+        self.__port = port
+        self.__state = state
+        self.__listener = None
+        if loop is None:
+            transport = TcpTransport() if transport is None else transport
+            self.__listener = transport.listen(port, Philosopher.WAIT_TIMEOUT)
+            self.__port = self.__listener.get_port()
         self.__queue = Queue()
         self.__killme = False
         self.__connections = []
 
         self.__ready = False
+        self.__ready_event = Event()
 
         Thread.__init__(self)
 
     def get_addresses(self):
         return [c.get_address() for c in self.__connections]
 
+    def get_port(self):
+        return self.__port
+
     def get_ready(self):
         return self.__ready
 
+    def wait_ready(self, timeout=None):
+        return self.__ready_event.wait(timeout)
+
+    def __set_ready(self):
+        self.__ready = True
+        self.__ready_event.set()
+
     def run(self):
-        while not Philosopher.TIME_TO_DIE:
-            self.__ready = True
-            con, cliente = self.__socket.accept()
-            self.__connections.append(PhilosopherServerConnection(len(self.__connections), con, cliente))
+        self.__set_ready()
+        while not self.__state.time_to_die:
+            accepted = self.__listener.accept()
+            if accepted is None:
+                continue
+            channel, cliente = accepted
+            self.__connections.append(PhilosopherServerConnection(len(self.__connections), channel, cliente,
+                                                                  self.__state))
             self.__connections[-1].start()
 
-        self.__socket.close()
+        self.__listener.close()
+
+    async def serve(self, loop):
+        listener = await serve(loop, self.__port, self.__serve_connection, Philosopher.BIND)
+        self.__port = listener.sockets[0].getsockname()[1]
+        self.__set_ready()
+        loop.submit(self.__close_when_dead(listener))
+
+    async def __close_when_dead(self, listener):
+        while not self.__state.time_to_die:
+            await asyncio.sleep(Philosopher.WAIT_TIMEOUT)
+        listener.close()
+
+    async def __serve_connection(self, channel):
+        address = channel.get_peer()[0]
+        while not self.__state.time_to_die:
+            try:
+                request = await channel.read_async()
+            except ConnectionError:
+                break
+            response = PhilosopherServerConnection.handle_request(self.__state, address, request)
+            if response is not None:
+                await channel.send_async(response)
+                if response['code'] == 'HELLO_RESPONSE':
+                    channel.set_encoding(response['encoding'])
+
+        channel.close()
 
 
 class PhilosopherClient(object):
-    def __init__(self, address, port):
-        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    RECONNECT_ATTEMPTS = 5
+    RECONNECT_DELAY = 0.05
+    REQUEST_TIMEOUT = 2.0
+
+    def __init__(self, address, port, seat, state, loop=None, transport=None):
+        self.__state = state
+        self.__loop = loop
+        self.__transport = TcpTransport() if transport is None else transport
+        self.__seat = seat
         self.__address = (address, port)
-        print(self.__address)
+        self.__channel = None
+        logger.debug('Connecting to %s:%s', address, port)
 
-        self.__socket.connect(self.__address)
+        self.__reconnect()
 
     def get_address(self):
         return '{}:{}'.format(self.__address[0], self.__address[1])
 
-    def __get_with_fork_request(self, port):
-        request = {'code': 'GET_FORK_STATUS', 'port': port}
-        Philosopher.MESSAGES_SENT += 1
-        self.__socket.send(json.dumps(request).encode('utf-8'))
-        # print('{} withFork send {}'.format(self.__address[1], request))
-        response = json.loads(self.__socket.recv(1024).decode('utf-8'))
-        Philosopher.MESSAGES_RECEIVED += 1
-        # print('{} withFork recv'.format(self.__address[1]))
+    def get_seat(self):
+        return self.__seat
+
+    def close(self):
+        if self.__channel is not None:
+            self.__channel.close()
+            self.__channel = None
+
+    def __connect(self):
+        if self.__loop is None:
+            self.__channel = self.__transport.connect(self.__address, PhilosopherClient.REQUEST_TIMEOUT)
+        else:
+            self.__channel = self.__loop.call(open_channel(self.__loop, self.__address,
+                                                           PhilosopherClient.REQUEST_TIMEOUT, Philosopher.BIND))
+        self.__negotiate()
+
+    def __negotiate(self):
+        self.__channel.send({'code': 'HELLO', 'encodings': Philosopher.ENCODINGS})
+        response = self.__channel.read()
+        if response.get('code') == 'HELLO_RESPONSE':
+            self.__channel.set_encoding(response['encoding'])
+
+    def __reconnect(self):
+        if self.__channel is not None:
+            try:
+                self.__channel.close()
+            except OSError:
+                pass
+            self.__channel = None
+        for attempt in range(PhilosopherClient.RECONNECT_ATTEMPTS):
+            try:
+                self.__connect()
+                return
+            except OSError:
+                sleep(PhilosopherClient.RECONNECT_DELAY * 2 ** attempt)
+        raise ConnectionError('could not connect to {}'.format(self.get_address()))
+
+    def __send(self, request):
+        self.__channel.send(request)
+        self.__state.messages_sent.increment()
+
+    def __read(self):
+        response = self.__channel.read()
+        self.__state.messages_received.increment()
+        return response
+
+    def __request(self, request):
+        with self.__state.profiler.phase(request['code']):
+            try:
+                self.__send(request)
+                return self.__read()
+            except OSError:
+                self.__reconnect()
+                return None
+
+    def __pass_token_request(self, seat, turn):
+        request = {'code': 'POST_TOKEN', 'seat': seat, 'turn': turn}
+        response = self.__request(request)
+        if response is not None and 'code' in response and response['code'] == 'POST_TOKEN_RESPONSE':
+            return response.get('accepted', True)
+        return None
+
+    def __release_token_request(self, seat):
+        request = {'code': 'POST_TOKEN_RELEASED', 'seat': seat}
+        response = self.__request(request)
+        if response is not None and 'code' in response and response['code'] == 'POST_TOKEN_RELEASED_RESPONSE':
+            return True
+        return None
+
+    @staticmethod
+    def __parse_request_fork(response):
         if response is not None and 'code' in response and response[
-            'code'] == 'GET_FORK_STATUS_RESPONSE' and 'withFork' in response:
-            return response['withFork'], response['state']
+            'code'] == 'REQUEST_FORK_RESPONSE' and 'granted' in response:
+            return response['granted']
         return None
 
-    def __pass_token_request(self, port):
-        request = {'code': 'POST_TOKEN', 'port': port}
-        self.__socket.send(json.dumps(request).encode('utf-8'))
-        Philosopher.MESSAGES_SENT += 1
-        response = json.loads(self.__socket.recv(1024).decode('utf-8'))
-        Philosopher.MESSAGES_RECEIVED += 1
-        if response is not None and 'code' in response and response['code'] == 'POST_TOKEN_RESPONSE':
+    def __request_fork_request(self, seat, turn):
+        request = {'code': 'REQUEST_FORK', 'seat': seat, 'turn': turn}
+        return PhilosopherClient.__parse_request_fork(self.__request(request))
+
+    @staticmethod
+    def __parse_acquire_fork(response):
+        if response is not None and 'code' in response and response[
+            'code'] == 'ACQUIRE_FORK_RESPONSE' and 'granted' in response:
+            return response['granted'], response['state']
+        return None
+
+    def __acquire_fork_request(self, seat):
+        request = {'code': 'ACQUIRE_FORK', 'seat': seat}
+        return PhilosopherClient.__parse_acquire_fork(self.__request(request))
+
+    def __post_fork_request(self, seat):
+        request = {'code': 'POST_FORK', 'seat': seat}
+        response = self.__request(request)
+        if response is not None and 'code' in response and response['code'] == 'POST_FORK_RESPONSE':
             return True
         return None
 
-    def with_fork(self, port):
-        result = self.__get_with_fork_request(port)
+    def send_request_fork(self, seat, turn):
+        with self.__state.profiler.phase('REQUEST_FORK'):
+            try:
+                self.__send({'code': 'REQUEST_FORK', 'seat': seat, 'turn': turn})
+                return True
+            except OSError:
+                self.__reconnect()
+                return False
+
+    def receive_request_fork(self, seat, turn):
+        try:
+            with self.__state.profiler.phase('REQUEST_FORK_RESPONSE'):
+                result = PhilosopherClient.__parse_request_fork(self.__read())
+        except OSError:
+            self.__reconnect()
+            result = None
+        if result is None:
+            result = self.request_fork(seat, turn)
+        return result
+
+    # A retry carries the same turn, so the neighbour answers it as the request it may already have served.
+    def request_fork(self, seat, turn):
+        result = self.__request_fork_request(seat, turn)
+        while result is None:
+            result = self.__request_fork_request(seat, turn)
+        return result
+
+    def post_fork(self, seat):
+        while self.__post_fork_request(seat) is None:
+            pass
+
+    def send_acquire_fork(self, seat):
+        with self.__state.profiler.phase('ACQUIRE_FORK'):
+            try:
+                self.__send({'code': 'ACQUIRE_FORK', 'seat': seat})
+                return True
+            except OSError:
+                self.__reconnect()
+                return False
+
+    def receive_acquire_fork(self, seat):
+        try:
+            with self.__state.profiler.phase('ACQUIRE_FORK_RESPONSE'):
+                result = PhilosopherClient.__parse_acquire_fork(self.__read())
+        except OSError:
+            self.__reconnect()
+            result = None
+        if result is None:
+            result = self.acquire_fork(seat)
+        return result
+
+    def acquire_fork(self, seat):
+        result = self.__acquire_fork_request(seat)
         while result is None:
-            result = self.__get_with_fork_request(port)
+            result = self.__acquire_fork_request(seat)
         return result
 
-    def pass_token(self, port):
-        while self.__pass_token_request(port) is None:
+    def release_fork(self, seat):
+        with self.__state.profiler.phase('RELEASE_FORK'):
+            while True:
+                try:
+                    self.__send({'code': 'RELEASE_FORK', 'seat': seat})
+                    return
+                except OSError:
+                    self.__reconnect()
+
+    def pass_token(self, seat, turn):
+        start = perf_counter()
+        accepted = self.__pass_token_request(seat, turn)
+        while accepted is None:
+            accepted = self.__pass_token_request(seat, turn)
+        self.__state.token_passes.observe(perf_counter() - start)
+        return accepted
+
+    def release_token(self, seat):
+        while self.__release_token_request(seat) is None:
             pass
 
 
+class PhilosopherPool(object):
+    def __init__(self, state, loop=None, transport=None):
+        self.__state = state
+        self.__loop = loop
+        self.__transport = transport
+        self.__clients = {}
+
+    def add(self, seat, address):
+        if seat in self.__clients and self.__clients[seat].get_address() != address:
+            self.remove(seat)
+        if seat not in self.__clients:
+            host, port = address.rsplit(':', 1)
+            self.__clients[seat] = PhilosopherClient(host, int(port), seat, self.__state, self.__loop,
+                                                     self.__transport)
+        return self.__clients[seat]
+
+    def get(self, seat):
+        return self.__clients[seat]
+
+    def address(self, seat):
+        client = self.__clients.get(seat)
+        return client.get_address() if client is not None else None
+
+    def remove(self, seat):
+        client = self.__clients.pop(seat, None)
+        if client is not None:
+            client.close()
+
+    def get_clients(self):
+        return list(self.__clients.values())
+
+    def close(self):
+        for client in self.__clients.values():
+            client.close()
+
+    # Like request_forks, an unreachable neighbour maps to None and every other answer is still read, a grant left
+    # in the socket would keep that fork lent to us.
+    def acquire_forks(self, seat, neighbours):
+        start = perf_counter()
+        results = {}
+        pending = []
+        for client in [self.__clients[neighbour] for neighbour in neighbours]:
+            try:
+                if client.send_acquire_fork(seat):
+                    pending.append(client)
+                else:
+                    results[client.get_seat()] = client.acquire_fork(seat)
+            except ConnectionError:
+                results[client.get_seat()] = None
+        for client in pending:
+            try:
+                results[client.get_seat()] = client.receive_acquire_fork(seat)
+            except ConnectionError:
+                results[client.get_seat()] = None
+        self.__state.fork_requests.observe(perf_counter() - start)
+        return results
+
+    def release_forks(self, seat, neighbours):
+        lost = None
+        for neighbour in neighbours:
+            try:
+                self.__clients[neighbour].release_fork(seat)
+            except ConnectionError as e:
+                lost = e
+        if lost is not None:
+            raise lost
+
+    # A neighbour that cannot be reached maps to None; the others still get their answers read, since a granted
+    # fork left unread would be lost for good.
+    def request_forks(self, seat, turns):
+        results = {}
+        pending = []
+        for neighbour, turn in turns.items():
+            client = self.__clients[neighbour]
+            try:
+                if client.send_request_fork(seat, turn):
+                    pending.append((client, turn))
+                else:
+                    results[neighbour] = client.request_fork(seat, turn)
+            except ConnectionError:
+                results[neighbour] = None
+        for client, turn in pending:
+            try:
+                results[client.get_seat()] = client.receive_request_fork(seat, turn)
+            except ConnectionError:
+                results[client.get_seat()] = None
+        return results
+
+
 class Philosopher(Thread):
-    WITH_FORK = {}
-    TOKEN = (False, "")
-    STATE = 'THINKING'
-    DEADLOCKS = 0
-    MEALS = 0
-    TIME_TO_DIE = False
-    MESSAGES_RECEIVED = 0
-    MESSAGES_SENT = 0
-
-    WITH_TOKEN = True
-
-    def __init__(self, manager_address, port):
-        self.__port = port
-        self.__manager_client = ManagerClient(manager_address, self.__port)
-        self.__manager_client.start()
+    WAIT_TIMEOUT = 1.0
+    ENCODINGS = ENCODINGS
+    BIND = None
+    ADVERTISE = None
+    BACKOFF_LIMIT = 6
+    BACKOFF_SLOT = 0.001
+    PROFILE = False
+
+    def __init__(self, manager_address, port, loop=None, min_time=5, max_time=50, transport=None):
+        self.__loop = loop
+        self.__state = PhilosopherState()
+        if Philosopher.PROFILE:
+            self.__state.profiler = Profiler()
         Thread.__init__(self)
 
-        self.__philosopher_server = PhilosopherServer(port)
-        self.__philosopher_server.start()
-        self.__philosophers = {}
+        if transport is None and loop is None:
+            transport = TcpTransport(Philosopher.BIND)
+
+        self.__philosopher_server = PhilosopherServer(port, self.__state, loop, transport)
+        if loop is not None:
+            loop.call(self.__philosopher_server.serve(loop))
+        self.__port = self.__philosopher_server.get_port()
+        self.__log = logging.LoggerAdapter(logger, {'port': self.__port})
+        self.__manager_client = ManagerClient(manager_address, self.__port, self.__state, transport)
+        if loop is None:
+            self.__manager_client.start()
+            self.__philosopher_server.start()
+        else:
+            loop.submit(self.__manager_client.serve(loop))
+        self.__philosophers = PhilosopherPool(self.__state, loop, transport)
 
-        self.__min_time = 5
-        self.__max_time = 50
+        self.__min_time = min_time
+        self.__max_time = max_time
 
-        Philosopher.STATE = 'THINKING'
         self.__next_sleeping_time = randint(self.__min_time, self.__max_time)
         self.__next_thinking_time = randint(self.__min_time, self.__max_time)
+        self.__pairs_version = 0
+        self.__contending = set()
+        self.__backoff = 0
+        self.__slot = Philosopher.BACKOFF_SLOT
+        self.__penalty = 0
+
+    def get_port(self):
+        return self.__port
+
+    def get_metrics(self):
+        return self.__state.metrics
+
+    def get_profile(self):
+        return self.__state.profiler.snapshot()
+
+    # The version is only taken once every neighbour is connected, so a failed connection gets the pairs applied
+    # again; a seat left without a client reads as changed and starts over.
+    def __apply_pairs(self):
+        version = self.__manager_client.get_pairs_version()
+        neighbours = self.__manager_client.get_neighbours()
+        pairs = dict(zip(neighbours, self.__manager_client.get_pairs()))
+        forks = self.__state.forks
+        # a seat taken over by a late joiner starts over, nothing the previous philosopher held carries on
+        for seat in [seat for seat in self.__state.with_fork
+                     if seat not in pairs or self.__philosophers.address(seat) != pairs[seat]]:
+            self.__log.info('Seat %s left the table', seat)
+            self.__state.drop_fork(seat)
+            self.__contending.discard(seat)
+            self.__philosophers.remove(seat)
+            if forks is not None:
+                forks.remove(seat)
+        for seat, address in pairs.items():
+            if seat not in self.__state.with_fork:
+                self.__state.seat_fork(seat)
+                if forks is not None:
+                    forks.add(seat)
+            self.__philosophers.add(seat, address)
+        self.__pairs_version = version
+        if self.__state.token[1] is not None and self.__state.token[1] not in pairs and len(neighbours) > 0:
+            self.__state.token = (self.__state.token[0], neighbours[-1])
+        if forks is not None:
+            self.__post_forks(forks.reset())
+
+    def __post_forks(self, seats):
+        lost = None
+        with self.__state.profiler.phase('postForks'):
+            for seat in seats:
+                try:
+                    self.__philosophers.get(seat).post_fork(self.__state.seat)
+                except ConnectionError as e:
+                    lost = e
+        if lost is not None:
+            raise lost
+
+    def __pass_token(self):
+        destination = self.__state.token[1]
+        self.__state.token = (False, destination)
+        if self.__state.tokens > 1:
+            self.__state.ahead_busy = True
+        turn = not self.__state.token_turns.get(destination, False)
+        self.__state.token_turns[destination] = turn
+        try:
+            accepted = self.__philosophers.get(destination).pass_token(self.__state.seat, turn)
+        except ConnectionError:
+            self.__state.ahead_busy = False
+            self.__state.token = (True, destination)
+            raise
+        if not accepted:
+            self.__state.ahead_busy = False
+            self.__state.token = (True, destination)
+            return
+        self.__state.token = (False, None)
+        if self.__state.tokens > 1:
+            behind = next((seat for seat in self.__state.with_fork if seat != destination), destination)
+            self.__philosophers.get(behind).release_token(self.__state.seat)
+
+    def __dine_hygienically(self):
+        self.__log.debug('Trying to eat')
+        forks = self.__state.forks
+        start = perf_counter()
+        while not forks.acquire(0):
+            if self.__state.time_to_die or self.__manager_client.get_pairs_version() != self.__pairs_version:
+                return
+            missing = forks.missing()
+            if len(missing) > 0:
+                for p in missing:
+                    self.__log.debug('Asking fork to %s', self.__philosophers.get(p).get_address())
+                unreachable = []
+                with self.__state.profiler.phase('requestForks'):
+                    turns = dict((seat, forks.turn(seat)) for seat in missing)
+                    granted_forks = self.__philosophers.request_forks(self.__state.seat, turns)
+                for seat, granted in granted_forks.items():
+                    if granted:
+                        forks.receive(seat)
+                    elif granted is None:
+                        forks.ask_again(seat)
+                        unreachable.append(seat)
+                if len(unreachable) > 0:
+                    raise ConnectionError('could not ask seats {} for their forks'.format(unreachable))
+            else:
+                with self.__state.profiler.phase('waitForks'):
+                    if forks.acquire(Philosopher.WAIT_TIMEOUT):
+                        break
+        self.__state.fork_requests.observe(perf_counter() - start)
+        self.__state.meals.increment()
+        self.__log.debug('Eating')
+        self.__post_forks(forks.release())
+        self.__log.debug('Going to sleep')
+
+    # Every contended attempt doubles the window the extra sleep is drawn from, in slots as long as the last round
+    # trip to the neighbours and never shorter than BACKOFF_SLOT, so neighbours fighting over a fork spread their
+    # retries out instead of colliding again.
+    def __back_off(self):
+        self.__backoff = min(self.__backoff + 1, Philosopher.BACKOFF_LIMIT)
+        self.__penalty = uniform(0, 2 ** self.__backoff - 1) * self.__slot * 1000.0
+
+    def __put_forks_down(self):
+        held = [seat for seat, fork_state in self.__state.with_fork.items() if fork_state]
+        for seat in held:
+            self.__state.with_fork[seat] = False
+        with self.__state.profiler.phase('releaseForks'):
+            self.__philosophers.release_forks(self.__state.seat,
+                                              [seat for seat in held if not self.__state.hosts(seat)])
+
+    def __contended(self, seat):
+        # one deadlock per stretch of the fork being held, not one per look at it
+        if seat not in self.__contending:
+            self.__state.deadlocks.increment()
+            self.__contending.add(seat)
+
+    # Forks are taken all or none: a denied fork puts down the ones granted, so nobody holds a fork while waiting
+    # for another. The hosted forks are taken first since they cost no message, and a denied one spares the requests.
+    def __try_to_eat(self):
+        self.__log.debug('Trying to eat')
+        with_fork = self.__state.with_fork
+        # only the token holder may take forks, anybody else would ask for nothing
+        if self.__state.with_token and not self.__state.token[0]:
+            return
+        remote = [seat for seat in with_fork if not self.__state.hosts(seat)]
+        # whatever way the attempt ends, a lost neighbour included, the forks taken so far go back down
+        try:
+            for seat in with_fork:
+                if seat in remote:
+                    continue
+                if self.__state.take_fork(seat):
+                    self.__contending.discard(seat)
+                else:
+                    self.__contended(seat)
+                    self.__back_off()
+                    return
+            for seat in remote:
+                self.__log.debug('Asking fork to %s', self.__philosophers.get(seat).get_address())
+            start = perf_counter()
+            with self.__state.profiler.phase('acquireForks'):
+                forks = self.__philosophers.acquire_forks(self.__state.seat, remote)
+            if len(remote) > 0:
+                self.__slot = max(perf_counter() - start, Philosopher.BACKOFF_SLOT)
+            contended = False
+            unreachable = []
+            for seat, answer in forks.items():
+                if answer is None:
+                    unreachable.append(seat)
+                    continue
+                granted, philosopher_state = answer
+                self.__log.debug('%s fork granted %s and state is %s', self.__philosophers.get(seat).get_address(),
+                                 granted, philosopher_state)
+                with_fork[seat] = granted
+                if granted:
+                    self.__contending.discard(seat)
+                else:
+                    contended = True
+                    self.__contended(seat)
+            if len(unreachable) > 0:
+                raise ConnectionError('could not ask seats {} for their forks'.format(unreachable))
+            if contended:
+                self.__back_off()
+                return
+
+            self.__state.meals.increment()
+            self.__log.debug('Eating')
+            self.__backoff = 0
+        finally:
+            self.__put_forks_down()
+        if self.__state.with_token:
+            with self.__state.profiler.phase('passToken'):
+                self.__pass_token()
+        else:
+            self.__state.token = (False, None)
 
     def run(self):
-        print('Waiting be ready')
-        while (self.__manager_client.get_pairs() is None) or (not self.__philosopher_server.get_ready()):
-            pass
-        for p in self.__manager_client.get_pairs():
-            Philosopher.WITH_FORK[p] = False
-            self.__philosophers[p] = PhilosopherClient(p.split(":")[0], int(p.split(':')[1]))
+        self.__log.info('Waiting be ready')
+        while not self.__manager_client.wait_pairs(Philosopher.WAIT_TIMEOUT) or \
+                not self.__philosopher_server.wait_ready(Philosopher.WAIT_TIMEOUT):
+            if self.__state.time_to_die:
+                return
+        with self.__state.profiler.phase('applyPairs'):
+            self.__apply_pairs()
 
         self.__manager_client.set_ready(True)
-        print('Waiting begin')
-        while not self.__manager_client.get_begin():
-            pass
-        while not Philosopher.TIME_TO_DIE:
-            if Philosopher.STATE == 'THINKING':
-                print('Thinking')
-                sleep(self.__next_thinking_time / 1000.0)
-                self.__next_thinking_time = randint(self.__min_time, self.__max_time)
-                Philosopher.STATE = 'EATING'
-            elif Philosopher.STATE == 'EATING':
-                print('Trying to eat')
-                deadlock = dict([[key, False] for key in Philosopher.WITH_FORK])
-                for p in self.__philosophers.values():
-                    print('Asking fork to {}'.format(p.get_address()))
-                    fork_state, philosopher_state = p.with_fork(self.__port)
-                    print('{} fork is {} and state is {}'.format(p.get_address(), fork_state, philosopher_state))
-                    # print('{} - {}'.format(p.get_address(), fork_state))
-                    if fork_state and not Philosopher.WITH_FORK[p.get_address()] and not deadlock[p.get_address()] and \
-                            (Philosopher.TOKEN[0] or not Philosopher.WITH_TOKEN):
-                        deadlock[p.get_address()] = True
-                        Philosopher.DEADLOCKS += 1
-                    if not fork_state and not Philosopher.WITH_FORK[p.get_address()] and (Philosopher.TOKEN[0] or not Philosopher.WITH_TOKEN):
-                        Philosopher.WITH_FORK[p.get_address()] = True
-
-                if reduce((lambda x, y: x and y), Philosopher.WITH_FORK.values()) and (Philosopher.TOKEN[0] or not Philosopher.WITH_TOKEN):
-                    Philosopher.MEALS += 1
-                    print('Eating')
-                    for p in Philosopher.WITH_FORK:
-                        Philosopher.WITH_FORK[p] = False
-
-                    if Philosopher.WITH_TOKEN:
-                        self.__philosophers[Philosopher.TOKEN[1]].pass_token(self.__port)
-                    Philosopher.TOKEN = (False, "")
-
-                print('Going to sleep')
-                Philosopher.STATE = 'SLEEPING'
-
-                # while not reduce((lambda x, y: x and y), Philosopher.WITH_FORK.values()):
-                #     for p in self.__philosophers:
-                #         print('Asking fork to {}'.format(p.get_address()))
-                #         fork_state, philosopher_state = p.with_fork(self.__port)
-                #         print('{} fork is {} and state is {}'.format(p.get_address(), fork_state, philosopher_state))
-                #         # print('{} - {}'.format(p.get_address(), fork_state))
-                #         if fork_state and not Philosopher.WITH_FORK[p.get_address()] and not deadlock[p.get_address()]:
-                #             deadlock[p.get_address()] = True
-                #             Philosopher.DEADLOCKS += 1
-                #         if not fork_state and not Philosopher.WITH_FORK[p.get_address()]:
-                #             Philosopher.WITH_FORK[p.get_address()] = True
-
-
-            elif Philosopher.STATE == 'SLEEPING':
-                print('Sleeping')
-                self.__next_sleeping_time = randint(self.__min_time, self.__max_time)
-                sleep(self.__next_thinking_time / 1000.0)
-                Philosopher.STATE = 'THINKING'
+        self.__log.info('Waiting begin')
+        while not self.__manager_client.wait_begin(Philosopher.WAIT_TIMEOUT):
+            if self.__state.time_to_die:
+                self.__philosophers.close()
+                return
+        while not self.__state.time_to_die:
+            try:
+                if self.__manager_client.get_pairs_version() != self.__pairs_version:
+                    with self.__state.profiler.phase('applyPairs'):
+                        self.__apply_pairs()
+                if self.__state.state == 'THINKING':
+                    self.__log.debug('Thinking')
+                    with self.__state.profiler.phase('THINKING'):
+                        sleep(self.__next_thinking_time / 1000.0)
+                    self.__next_thinking_time = randint(self.__min_time, self.__max_time)
+                    self.__state.state = 'EATING'
+                elif self.__state.state == 'EATING' and self.__state.mode == 'CHANDY_MISRA':
+                    with self.__state.profiler.phase('EATING'):
+                        self.__dine_hygienically()
+                    self.__state.state = 'SLEEPING'
+                elif self.__state.state == 'EATING':
+                    with self.__state.profiler.phase('EATING'):
+                        self.__try_to_eat()
+                    self.__log.debug('Going to sleep')
+                    self.__state.state = 'SLEEPING'
+
+                elif self.__state.state == 'SLEEPING':
+                    self.__log.debug('Sleeping')
+                    self.__next_sleeping_time = randint(self.__min_time, self.__max_time)
+                    with self.__state.profiler.phase('SLEEPING'):
+                        sleep((self.__next_thinking_time + self.__penalty) / 1000.0)
+                    self.__penalty = 0
+                    self.__state.state = 'THINKING'
+
+            except ConnectionError as e:
+                if not self.__state.time_to_die:
+                    self.__log.info('Lost a neighbour, %s', e)
+                self.__state.state = 'SLEEPING'
+        self.__philosophers.close()
+
+
+def run_philosophers(manager_address, ports, use_asyncio=False, metrics_path=None, min_time=5, max_time=50,
+                     encoding=None, log_options=None, bind=None, advertise=None, profile_path=None):
+    listener = None
+    if log_options is not None:
+        listener = configure(*log_options)
+    if encoding is not None:
+        Philosopher.ENCODINGS = [encoding]
+    Philosopher.BIND = bind
+    Philosopher.ADVERTISE = advertise if advertise is not None else bind
+    Philosopher.PROFILE = profile_path is not None
+
+    loop = None
+    if use_asyncio:
+        loop = EventLoop()
+        loop.start()
+
+    philosophers = [Philosopher(manager_address, port, loop, min_time, max_time) for port in ports]
+    for philosopher in philosophers:
+        philosopher.start()
+    for philosopher in philosophers:
+        philosopher.join()
+
+    if metrics_path is not None:
+        with open(metrics_path, 'w') as metrics_file:
+            metrics_file.write(prometheus([({'port': p.get_port()}, p.get_metrics()) for p in philosophers]))
+    if profile_path is not None:
+        write_folded(profile_path, merge([p.get_profile() for p in philosophers]))
+
+    if listener is not None:
+        listener.stop()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--port", help="application port",
+    parser.add_argument("--port", help="application port, or the first port when --count is given",
                         type=int)
     parser.add_argument('--manager', help="manager address", type=str)
+    parser.add_argument('--asyncio', help="serve every connection from one asyncio event loop", action='store_true')
+    parser.add_argument('--count', help="number of philosophers to host", type=int, default=1)
+    parser.add_argument('--processes', help="number of processes the philosophers are spread over", type=int,
+                        default=1)
+    parser.add_argument('--min-time', help="shortest thinking or sleeping time in ms", type=int, default=5)
+    parser.add_argument('--max-time', help="longest thinking or sleeping time in ms", type=int, default=50)
+    parser.add_argument('--encoding', help="only offer or accept this encoding for fork traffic, "
+                                           "otherwise binary is preferred with json as the fallback",
+                        choices=ENCODINGS)
+    parser.add_argument('--metrics', help="write Prometheus text metrics to this file when the dinner ends",
+                        type=str)
+    parser.add_argument('--profile', help="time every phase of the dinner and every request to a neighbour, report "
+                                          "the timings with the status and write them to this file as folded "
+                                          "stacks for flamegraph.pl when the dinner ends", type=str)
+    parser.add_argument('--bind', help="local address to listen on and connect from, every address by default",
+                        type=str)
+    parser.add_argument('--advertise', help="host the other philosophers should dial, for when the manager sees "
+                                            "a different address, defaults to --bind", type=str)
+    add_arguments(parser)
 
     args = parser.parse_args()
 
     manager_address = (args.manager.split(':')[0], int(args.manager.split(':')[1]))
-    philosopher = Philosopher(manager_address, args.port)
-    philosopher.start()
-    philosopher.join()
+    ports = list(range(args.port, args.port + args.count))
+    configure_from(args)
+    if args.processes > 1:
+        processes = [Process(target=run_philosophers,
+                             args=(manager_address, ports[i::args.processes], args.asyncio,
+                                   None if args.metrics is None else '{}.{}'.format(args.metrics, i),
+                                   args.min_time, args.max_time, args.encoding,
+                                   (args.log_level, args.log_sample, args.log_rate,
+                                    None if args.trace is None else '{}.{}'.format(args.trace, i)),
+                                   args.bind, args.advertise,
+                                   None if args.profile is None else '{}.{}'.format(args.profile, i)))
+                     for i in range(min(args.processes, len(ports)))]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    else:
+        run_philosophers(manager_address, ports, args.asyncio, args.metrics, args.min_time, args.max_time,
+                         args.encoding, bind=args.bind, advertise=args.advertise, profile_path=args.profile)
 
-    print('I am dead')
+    logger.info('I am dead')
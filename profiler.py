@@ -0,0 +1,114 @@
+from threading import Lock, local
+from time import perf_counter
+
+
+class NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_PHASE = NullPhase()
+
+
+# Handed out while profiling is off, so an instrumented block costs one call returning a shared do-nothing phase.
+class NullProfiler(object):
+    def phase(self, name):
+        return NULL_PHASE
+
+    def snapshot(self):
+        return None
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class Phase(object):
+    __slots__ = ('__profiler', '__name')
+
+    def __init__(self, profiler, name):
+        self.__profiler = profiler
+        self.__name = name
+
+    def __enter__(self):
+        self.__profiler.enter(self.__name)
+        return self
+
+    def __exit__(self, *exc):
+        self.__profiler.exit()
+        return False
+
+
+# Every thread keeps its own open frames and totals, like the metrics cells, so timing never takes a lock. Totals
+# are keyed by the folded stack, 'EATING;acquireForks;ACQUIRE_FORK', and hold the count, the seconds spent and
+# the seconds spent outside nested phases.
+class Profiler(object):
+    def __init__(self):
+        self.__local = local()
+        self.__lock = Lock()
+        self.__cells = []
+
+    def __thread(self):
+        thread = getattr(self.__local, 'thread', None)
+        if thread is None:
+            thread = ([], {})
+            with self.__lock:
+                self.__cells.append(thread[1])
+            self.__local.thread = thread
+        return thread
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def enter(self, name):
+        self.__thread()[0].append([name, perf_counter(), 0.0])
+
+    def exit(self):
+        frames, stacks = self.__thread()
+        stack = ';'.join(frame[0] for frame in frames)
+        name, start, nested = frames.pop()
+        elapsed = perf_counter() - start
+        if len(frames) > 0:
+            frames[-1][2] += elapsed
+        totals = stacks.get(stack)
+        if totals is None:
+            totals = stacks[stack] = [0, 0.0, 0.0]
+        totals[0] += 1
+        totals[1] += elapsed
+        totals[2] += elapsed - nested
+
+    def snapshot(self):
+        with self.__lock:
+            cells = list(self.__cells)
+        return merge([dict((stack, list(totals)) for stack, totals in list(cell.items())) for cell in cells])
+
+
+def merge(profiles):
+    merged = {}
+    for profile in profiles:
+        for stack, (count, seconds, own) in profile.items():
+            totals = merged.setdefault(stack, [0, 0.0, 0.0])
+            totals[0] += count
+            totals[1] += seconds
+            totals[2] += own
+    return merged
+
+
+# Share of the time spent in each outermost phase, the thinking, eating and sleeping split to tune against.
+def shares(profile):
+    phases = dict((stack, totals[1]) for stack, totals in profile.items() if ';' not in stack)
+    total = sum(phases.values())
+    if total == 0:
+        return {}
+    return dict((phase, seconds / total) for phase, seconds in phases.items())
+
+
+# One 'stack microseconds' line per stack, the folded format flamegraph.pl and speedscope read.
+def write_folded(path, profile):
+    with open(path, 'w') as folded:
+        for stack in sorted(profile):
+            microseconds = int(profile[stack][2] * 1000000)
+            if microseconds > 0:
+                folded.write('{} {}\n'.format(stack, microseconds))
@@ -0,0 +1,146 @@
+import json
+import socket
+import struct
+from collections import deque
+from threading import Lock
+
+HEADER = struct.Struct('!I')
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+ENCODINGS = ['binary', 'json']
+
+# Peer messages that fit the compact encoding: opcode, boolean field and integer field. Every binary payload
+# starts with its opcode, which never collides with the '{' JSON payloads start with, so readers decode both.
+BINARY_MESSAGE = struct.Struct('!BBi')
+BINARY_STATES = ['THINKING', 'EATING', 'SLEEPING']
+BINARY_CODES = {'POST_TOKEN': (3, 'turn', 'seat'),
+                'POST_TOKEN_RESPONSE': (4, 'accepted', None),
+                'POST_TOKEN_RELEASED': (5, None, 'seat'),
+                'POST_TOKEN_RELEASED_RESPONSE': (6, None, None),
+                'REQUEST_FORK': (7, 'turn', 'seat'),
+                'REQUEST_FORK_RESPONSE': (8, 'granted', None),
+                'POST_FORK': (9, None, 'seat'),
+                'POST_FORK_RESPONSE': (10, None, None),
+                'ACQUIRE_FORK': (11, None, 'seat'),
+                'ACQUIRE_FORK_RESPONSE': (12, 'granted', 'state'),
+                'RELEASE_FORK': (13, None, 'seat')}
+BINARY_OPCODES = dict((opcode, (code, flag, value)) for code, (opcode, flag, value) in BINARY_CODES.items())
+
+
+def encode_binary(data):
+    if data.get('code') not in BINARY_CODES:
+        return None
+    opcode, flag, value = BINARY_CODES[data['code']]
+    if any(key not in ('code', flag, value) for key in data):
+        return None
+    flag_value = data.get(flag, False)
+    field = data.get(value, 0)
+    if not isinstance(flag_value, bool):
+        return None
+    if value == 'state':
+        if field not in BINARY_STATES:
+            return None
+        field = BINARY_STATES.index(field)
+    elif not isinstance(field, int):
+        return None
+    return BINARY_MESSAGE.pack(opcode, flag_value, field)
+
+
+def decode_binary(payload):
+    opcode, flag_value, field = BINARY_MESSAGE.unpack(payload)
+    code, flag, value = BINARY_OPCODES[opcode]
+    data = {'code': code}
+    if flag is not None:
+        data[flag] = bool(flag_value)
+    if value == 'state':
+        data[value] = BINARY_STATES[field]
+    elif value is not None:
+        data[value] = field
+    return data
+
+
+def encode_message(data, encoding='json'):
+    payload = None
+    if encoding == 'binary':
+        payload = encode_binary(data)
+    if payload is None:
+        payload = json.dumps(data).encode('utf-8')
+    return HEADER.pack(len(payload)) + payload
+
+
+def decode_message(payload):
+    if len(payload) == BINARY_MESSAGE.size and payload[0] in BINARY_OPCODES:
+        return decode_binary(payload)
+    return json.loads(payload.decode('utf-8'))
+
+
+def choose_encoding(offered, supported):
+    return next((encoding for encoding in offered if encoding in supported), 'json')
+
+
+def send_message(sock, data, encoding='json'):
+    sock.sendall(encode_message(data, encoding))
+
+
+class MessageReader(object):
+    def __init__(self, sock=None, buffer_size=4096):
+        self.__socket = sock
+        self.__buffer_size = buffer_size
+        self.__buffer = bytearray()
+        self.__messages = deque()
+
+    def pending(self):
+        return len(self.__messages)
+
+    def feed(self, data):
+        self.__buffer.extend(data)
+        while len(self.__buffer) >= HEADER.size:
+            size = HEADER.unpack_from(self.__buffer)[0]
+            if size > MAX_MESSAGE_SIZE:
+                raise ValueError('message of {} bytes exceeds the limit'.format(size))
+            if len(self.__buffer) < HEADER.size + size:
+                break
+            payload = bytes(self.__buffer[HEADER.size:HEADER.size + size])
+            del self.__buffer[:HEADER.size + size]
+            self.__messages.append(decode_message(payload))
+
+    def next_message(self):
+        if self.__messages:
+            return self.__messages.popleft()
+        return None
+
+    def read(self):
+        while not self.__messages:
+            chunk = self.__socket.recv(self.__buffer_size)
+            if not chunk:
+                raise ConnectionError('connection closed by peer')
+            self.feed(chunk)
+        return self.__messages.popleft()
+
+
+class SocketChannel(object):
+    # Every message goes out in one write, so there is nothing for Nagle to coalesce, only a one-way message such as
+    # RELEASE_FORK that would hold the next request back until the peer's delayed ACK. Asyncio sets this itself.
+    def __init__(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.__socket = sock
+        self.__reader = MessageReader(sock)
+        self.__lock = Lock()
+        self.__encoding = 'json'
+
+    @staticmethod
+    def connect(address, timeout=None, bind=None):
+        return SocketChannel(socket.create_connection(address, timeout, None if bind is None else (bind, 0)))
+
+    def set_encoding(self, encoding):
+        self.__encoding = encoding
+
+    def send(self, data):
+        with self.__lock:
+            send_message(self.__socket, data, self.__encoding)
+
+    def read(self):
+        return self.__reader.read()
+
+    def close(self):
+        self.__socket.close()
@@ -0,0 +1,104 @@
+import csv
+import mmap
+import struct
+
+SERIES_MAGIC = b'DINR'
+SERIES_VERSION = 1
+SERIES_HEADER = struct.Struct('!4sBI')
+COLUMNS = ['meals', 'deadlocks', 'messagesSent', 'messagesReceived']
+ABSENT, PRESENT, HOLDER = 0, 1, 2
+
+
+# One tick is the time followed by one column per counter and a seat state column, each holding every seat, so a
+# file is a header plus equal sized blocks that can be mapped and sliced without parsing.
+def tick_struct(seats):
+    return struct.Struct('!d' + '{}I'.format(seats) * len(COLUMNS) + '{}B'.format(seats))
+
+
+def seat_state(status):
+    if status is None:
+        return ABSENT
+    token = status.get('token', (False, None))
+    return HOLDER if token[0] or token[1] is not None else PRESENT
+
+
+class BinarySeries(object):
+    def __init__(self, path, seats):
+        self.__seats = seats
+        self.__tick = tick_struct(seats)
+        self.__file = open(path, 'wb')
+        self.__file.write(SERIES_HEADER.pack(SERIES_MAGIC, SERIES_VERSION, seats))
+
+    def record(self, elapsed, statuses):
+        values = [elapsed]
+        for column in COLUMNS:
+            values.extend(statuses[seat][column] if seat in statuses else 0 for seat in range(self.__seats))
+        values.extend(seat_state(statuses.get(seat)) for seat in range(self.__seats))
+        self.__file.write(self.__tick.pack(*values))
+        self.__file.flush()
+
+    def close(self):
+        self.__file.close()
+
+
+class CsvSeries(object):
+    def __init__(self, path, seats):
+        self.__file = open(path, 'w', newline='')
+        self.__writer = csv.writer(self.__file)
+        self.__writer.writerow(['time', 'seat'] + COLUMNS + ['state'])
+
+    def record(self, elapsed, statuses):
+        for seat in sorted(statuses):
+            status = statuses[seat]
+            self.__writer.writerow(['{:.3f}'.format(elapsed), seat] + [status[column] for column in COLUMNS] +
+                                   [seat_state(status)])
+        self.__file.flush()
+
+    def close(self):
+        self.__file.close()
+
+
+def open_series(path, seats):
+    if path.endswith('.csv'):
+        return CsvSeries(path, seats)
+    return BinarySeries(path, seats)
+
+
+def read_binary(path):
+    with open(path, 'rb') as series, mmap.mmap(series.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        magic, version, seats = SERIES_HEADER.unpack_from(data, 0)
+        if magic != SERIES_MAGIC or version != SERIES_VERSION:
+            raise ValueError('{} is not a dinner time series'.format(path))
+        tick = tick_struct(seats)
+        ticks = []
+        for offset in range(SERIES_HEADER.size, len(data) - tick.size + 1, tick.size):
+            values = tick.unpack_from(data, offset)
+            states = values[1 + seats * len(COLUMNS):]
+            rows = []
+            for seat in range(seats):
+                if states[seat] == ABSENT:
+                    rows.append(None)
+                else:
+                    rows.append(tuple(values[1 + seats * i + seat] for i in range(len(COLUMNS))) + (states[seat],))
+            ticks.append((values[0], rows))
+    return seats, ticks
+
+
+def read_csv(path):
+    ticks = {}
+    seats = 0
+    with open(path, newline='') as series:
+        for row in csv.DictReader(series):
+            seat = int(row['seat'])
+            seats = max(seats, seat + 1)
+            values = tuple(int(row[column]) for column in COLUMNS) + (int(row['state']),)
+            ticks.setdefault(float(row['time']), {})[seat] = values
+    return seats, [(elapsed, [ticks[elapsed].get(seat) for seat in range(seats)]) for elapsed in sorted(ticks)]
+
+
+# Either format reads back as the number of seats and a list of (seconds since the dinner began, rows), with a row
+# of counters and state per seat, or None for a seat nobody sat in at that tick.
+def read_series(path):
+    if path.endswith('.csv'):
+        return read_csv(path)
+    return read_binary(path)
@@ -0,0 +1,356 @@
+import argparse
+import json
+import logging
+from collections import deque
+from heapq import heappop, heappush
+from itertools import count
+from random import Random
+from time import perf_counter
+
+from chandy_misra import HygienicForks
+from log import add_arguments, configure_from
+from manager import Server
+from philosopher import Philosopher, PhilosopherState
+from topology import Topology
+
+logger = logging.getLogger('simulation')
+
+
+# Replays the Philosopher.run cycle on a virtual millisecond clock, so a run is fully determined by its seed. Every
+# message is an event delivered latency milliseconds after it is sent and acted on by the receiver at that time, and
+# a meal holds its forks for eat_time, so a fork can be in use when a neighbour asks for it.
+class Simulation(object):
+    def __init__(self, topology, mode, duration, seed=0, min_time=5, max_time=50, tokens=1, latency=0.1,
+                 eat_time=0):
+        self.__topology = topology
+        self.__mode = mode
+        self.__duration = int(duration * 1000)
+        self.__random = Random(seed)
+        self.__min_time = min_time
+        self.__max_time = max_time
+        self.__latency = latency
+        self.__eat_time = eat_time
+        self.__clock = 0
+        self.__events = []
+        # every message takes the same latency, so messages arrive in the order they were sent and a queue keeps
+        # them sorted without the heap
+        self.__in_flight = deque()
+        self.__sequence = count()
+        self.__waiting = set()
+        self.__hungry_since = {}
+        # plain per-seat ints, the sharded metrics counters cost a thread-local lookup per increment and are only
+        # filled in once the run is over
+        self.__meals = [0] * topology.size()
+        self.__deadlocks = [0] * topology.size()
+        self.__sent = [0] * topology.size()
+        self.__received = [0] * topology.size()
+        self.__backoff = [0] * topology.size()
+        self.__penalty = [0] * topology.size()
+        self.__contending = [set() for _ in range(topology.size())]
+        self.__answers = [None] * topology.size()
+        self.__remote = []
+        # the slot a real philosopher measures is its round trip to the neighbours
+        self.__slot = max(2 * latency, Philosopher.BACKOFF_SLOT * 1000.0)
+
+        holders = Server.token_holders(topology.size(), tokens) if mode == 'TOKEN' else set()
+        self.__states = []
+        for seat in range(topology.size()):
+            neighbours = topology.get_neighbours(seat)
+            state = PhilosopherState()
+            state.seat = seat
+            state.mode = mode
+            state.with_token = mode == 'TOKEN'
+            state.tokens = tokens
+            for neighbour in neighbours:
+                state.seat_fork(neighbour)
+            if seat in holders and len(neighbours) > 0:
+                state.token = (True, neighbours[-1])
+            state.ahead_busy = tokens > 1 and len(neighbours) > 0 and neighbours[-1] in holders
+            if mode == 'CHANDY_MISRA':
+                state.forks = HygienicForks(seat, neighbours)
+            self.__states.append(state)
+            self.__remote.append([neighbour for neighbour in neighbours if not state.hosts(neighbour)])
+
+    def get_states(self):
+        return self.__states
+
+    def get_clock(self):
+        return self.__clock / 1000.0
+
+    def __draw(self):
+        return self.__min_time + int(self.__random.random() * (self.__max_time - self.__min_time + 1))
+
+    def __schedule(self, delay, action, *args):
+        heappush(self.__events, (self.__clock + delay, next(self.__sequence), action, args))
+
+    def __message(self, sender, receiver):
+        self.__sent[sender] += 1
+        self.__received[receiver] += 1
+
+    def __send(self, sender, receiver, action, *args):
+        self.__sent[sender] += 1
+        self.__received[receiver] += 1
+        self.__in_flight.append((self.__clock + self.__latency, next(self.__sequence), action, args))
+
+    def __wake(self, seat):
+        if seat in self.__waiting:
+            self.__waiting.discard(seat)
+            self.__schedule(0, self.__try, seat)
+
+    def __try(self, seat):
+        self.__states[seat].state = 'EATING'
+        if self.__mode == 'CHANDY_MISRA':
+            self.__dine_hygienically(seat)
+        else:
+            self.__dine(seat)
+
+    # Like Philosopher.run after an attempt: sleeping, with any backoff penalty, then thinking, then hungry again.
+    def __done(self, seat):
+        self.__states[seat].state = 'SLEEPING'
+        self.__schedule(self.__draw() + self.__draw() + self.__penalty[seat], self.__try, seat)
+        self.__penalty[seat] = 0
+
+    def __pass_token(self, seat):
+        state = self.__states[seat]
+        destination = state.token[1]
+        state.token = (False, destination)
+        if state.tokens > 1:
+            state.ahead_busy = True
+        self.__send(seat, destination, self.__post_token, destination, seat)
+
+    def __post_token(self, seat, sender):
+        accepted = self.__states[seat].accept_token(sender)
+        self.__send(seat, sender, self.__token_posted, sender, accepted)
+
+    def __token_posted(self, seat, accepted):
+        state = self.__states[seat]
+        destination = state.token[1]
+        if not accepted:
+            state.ahead_busy = False
+            state.token = (True, destination)
+        else:
+            state.token = (False, None)
+            if state.tokens > 1:
+                behind = next((n for n in state.with_fork if n != destination), destination)
+                self.__send(seat, behind, self.__token_released, behind, seat)
+        self.__done(seat)
+
+    def __token_released(self, seat, sender):
+        self.__states[seat].ahead_busy = False
+        self.__message(seat, sender)
+
+    def __put_forks_down(self, seat):
+        state = self.__states[seat]
+        remote = self.__remote[seat]
+        for neighbour in [n for n in state.with_fork if state.with_fork[n]]:
+            state.with_fork[neighbour] = False
+            if neighbour in remote:
+                self.__send(seat, neighbour, self.__states[neighbour].return_fork, seat)
+
+    def __contended(self, seat, neighbour):
+        if neighbour not in self.__contending[seat]:
+            self.__deadlocks[seat] += 1
+            self.__contending[seat].add(neighbour)
+
+    def __back_off(self, seat):
+        self.__backoff[seat] = min(self.__backoff[seat] + 1, Philosopher.BACKOFF_LIMIT)
+        self.__penalty[seat] = self.__random.uniform(0, 2 ** self.__backoff[seat] - 1) * self.__slot
+
+    # Philosopher.__try_to_eat: hosted forks first, then the remote ones, all or none, and a denial puts the granted
+    # forks back down and backs off. The remote forks are asked for together and answered a round trip later.
+    def __dine(self, seat):
+        state = self.__states[seat]
+        if state.with_token and not state.token[0]:
+            self.__done(seat)
+            return
+        remote = self.__remote[seat]
+        for neighbour in state.with_fork:
+            if neighbour in remote:
+                continue
+            if state.take_fork(neighbour):
+                self.__contending[seat].discard(neighbour)
+            else:
+                self.__contended(seat, neighbour)
+                self.__put_forks_down(seat)
+                self.__back_off(seat)
+                self.__done(seat)
+                return
+        self.__answers[seat] = {}
+        if len(remote) == 0:
+            self.__answered(seat)
+        for neighbour in remote:
+            self.__send(seat, neighbour, self.__lend, neighbour, seat)
+
+    def __lend(self, seat, sender):
+        state = self.__states[seat]
+        self.__send(seat, sender, self.__lent, sender, seat, state.lend_fork(sender))
+
+    def __lent(self, seat, neighbour, granted):
+        state = self.__states[seat]
+        state.with_fork[neighbour] = granted
+        self.__answers[seat][neighbour] = granted
+        if len(self.__answers[seat]) == len(self.__remote[seat]):
+            self.__answered(seat)
+
+    def __answered(self, seat):
+        contended = False
+        for neighbour, granted in self.__answers[seat].items():
+            if granted:
+                self.__contending[seat].discard(neighbour)
+            else:
+                contended = True
+                self.__contended(seat, neighbour)
+        self.__answers[seat] = None
+        if contended:
+            self.__put_forks_down(seat)
+            self.__back_off(seat)
+            self.__done(seat)
+            return
+        self.__meals[seat] += 1
+        self.__backoff[seat] = 0
+        if self.__eat_time > 0:
+            self.__schedule(self.__eat_time, self.__eaten, seat)
+        else:
+            self.__eaten(seat)
+
+    def __eaten(self, seat):
+        state = self.__states[seat]
+        self.__put_forks_down(seat)
+        if state.with_token:
+            self.__pass_token(seat)
+        else:
+            state.token = (False, None)
+            self.__done(seat)
+
+    # A hungry philosopher asks for every missing fork at once and waits; a granted fork or one handed over after a
+    # neighbour's meal wakes it to try again.
+    def __dine_hygienically(self, seat):
+        state = self.__states[seat]
+        forks = state.forks
+        self.__hungry_since.setdefault(seat, self.__clock)
+        if forks.acquire(0):
+            state.fork_requests.observe((self.__clock - self.__hungry_since.pop(seat)) / 1000.0)
+            self.__meals[seat] += 1
+            if self.__eat_time > 0:
+                self.__schedule(self.__eat_time, self.__eaten_hygienically, seat)
+            else:
+                self.__eaten_hygienically(seat)
+            return
+        self.__waiting.add(seat)
+        for neighbour in forks.missing():
+            self.__send(seat, neighbour, self.__request, neighbour, seat, forks.turn(neighbour))
+
+    def __request(self, seat, sender, turn):
+        granted = self.__states[seat].forks.request(sender, turn)
+        self.__send(seat, sender, self.__requested, sender, seat, granted)
+        if granted:
+            self.__wake(seat)
+
+    def __requested(self, seat, neighbour, granted):
+        if granted:
+            self.__states[seat].forks.receive(neighbour)
+            self.__wake(seat)
+
+    def __eaten_hygienically(self, seat):
+        for neighbour in self.__states[seat].forks.release():
+            self.__send(seat, neighbour, self.__post_fork, neighbour, seat)
+        self.__done(seat)
+
+    def __post_fork(self, seat, sender):
+        self.__states[seat].forks.receive(sender)
+        self.__message(seat, sender)
+        self.__wake(seat)
+
+    def run(self):
+        for seat in range(len(self.__states)):
+            self.__schedule(self.__draw(), self.__try, seat)
+        events = self.__events
+        in_flight = self.__in_flight
+        while events or in_flight:
+            if in_flight and (not events or in_flight[0] < events[0]):
+                event = in_flight.popleft()
+            else:
+                event = heappop(events)
+            if event[0] >= self.__duration:
+                break
+            self.__clock, _, action, args = event
+            action(*args)
+        self.__clock = self.__duration
+        for seat, state in enumerate(self.__states):
+            state.meals.increment(self.__meals[seat])
+            state.deadlocks.increment(self.__deadlocks[seat])
+            state.messages_sent.increment(self.__sent[seat])
+            state.messages_received.increment(self.__received[seat])
+            state.time_to_die = True
+        return [state.status('FINALLY_DEAD_RESPONSE') for state in self.__states]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run a seeded dinner on a virtual clock")
+    parser.add_argument('--philosophers', help="number of philosophers", type=int)
+    parser.add_argument('--duration', help="Dinner's virtual duration in seconds", type=float)
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument('--token', help="Token mode", action='store_true')
+    modes.add_argument('--chandy-misra', help="Chandy-Misra hygienic forks mode", action='store_true')
+    parser.add_argument('--tokens', help="number of tokens spaced around the ring in token mode", type=int,
+                        default=1)
+    parser.add_argument('--topology', help="ring, grid, grid:ROWSxCOLUMNS or edges:FILE with one 'seat seat' "
+                                           "conflict per line", type=str, default='ring')
+    parser.add_argument('--seed', help="random seed, equal seeds replay equal dinners", type=int, default=0)
+    parser.add_argument('--min-time', help="shortest thinking or sleeping time in ms", type=int, default=5)
+    parser.add_argument('--max-time', help="longest thinking or sleeping time in ms", type=int, default=50)
+    parser.add_argument('--latency', help="one way message delay in ms", type=float, default=0.1)
+    parser.add_argument('--eat-time', help="ms a meal holds its forks, the real philosophers eat at once",
+                        type=float, default=0)
+    parser.add_argument('--output', help="append a JSON summary line to this file", type=str)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    mode = 'TOKEN' if args.token else 'CHANDY_MISRA' if args.chandy_misra else 'WITHOUT_TOKEN'
+    try:
+        topology = Topology.parse(args.topology, args.philosophers)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.token and not topology.is_ring():
+        parser.error('token mode needs a ring of at least 3 philosophers')
+    if args.tokens < 1 or (args.tokens > 1 and not args.token):
+        parser.error('--tokens needs token mode and at least one token')
+    # At 2K seats every seat either holds a token or sits right behind one, so every pass is refused for good.
+    if args.tokens > 1 and args.philosophers <= 2 * args.tokens:
+        parser.error('{} tokens need at least {} philosophers, so that some token always has a free seat '
+                     'ahead'.format(args.tokens, 2 * args.tokens + 1))
+    configure_from(args)
+    logger.info(mode)
+
+    start = perf_counter()
+    simulation = Simulation(topology, mode, args.duration, args.seed, args.min_time, args.max_time, args.tokens,
+                            args.latency, args.eat_time)
+    statuses = simulation.run()
+    elapsed = perf_counter() - start
+
+    for seat, status in enumerate(statuses):
+        Server.log_status('seat {}'.format(seat), status['token'], status['deadlocks'], status['meals'],
+                          status['messagesSent'], status['messagesReceived'], status['latency'])
+    Server.log_totals(statuses)
+    logger.info('Simulated %.1f s in %.2f s', simulation.get_clock(), elapsed)
+
+    if args.output is not None:
+        meals = sum(s['meals'] for s in statuses)
+        messages = sum(s['messagesSent'] for s in statuses)
+        deadlocks = sum(s['deadlocks'] for s in statuses)
+        with open(args.output, 'a') as output:
+            output.write(json.dumps({'philosophers': args.philosophers,
+                                     'mode': mode,
+                                     'tokens': args.tokens,
+                                     'topology': args.topology,
+                                     'seed': args.seed,
+                                     'thinkTime': [args.min_time, args.max_time],
+                                     'latency': args.latency,
+                                     'eatTime': args.eat_time,
+                                     'duration': args.duration,
+                                     'meals': meals,
+                                     'mealsPerSecond': meals / args.duration,
+                                     'messages': messages,
+                                     'messagesPerMeal': messages / meals if meals else None,
+                                     'deadlocks': deadlocks,
+                                     'deadlocksPerSecond': deadlocks / args.duration}) + '\n')
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from analysis import analyse, jain_index
+from series import open_series
+
+
+def status(meals, holder=False):
+    return {'meals': meals, 'deadlocks': 0, 'messagesSent': 2 * meals, 'messagesReceived': 2 * meals,
+            'token': (holder, None)}
+
+
+class JainIndexTest(unittest.TestCase):
+    def test_even_meals_are_perfectly_fair(self):
+        self.assertEqual(jain_index([3, 3, 3]), 1.0)
+
+    def test_one_seat_eating_alone(self):
+        self.assertEqual(jain_index([4, 0, 0, 0]), 0.25)
+
+    def test_no_meals_has_no_index(self):
+        self.assertIsNone(jain_index([]))
+        self.assertIsNone(jain_index([0, 0]))
+
+
+class AnalyseTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'dinner.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, ticks, seats=2):
+        series = open_series(self.path, seats)
+        for elapsed, statuses in ticks:
+            series.record(elapsed, statuses)
+        series.close()
+
+    def test_summary_of_a_two_seat_dinner(self):
+        self.record([(0.5, {0: status(1), 1: status(0, True)}),
+                     (1.5, {0: status(2, True), 1: status(0)}),
+                     (2.5, {0: status(3), 1: status(2, True)})])
+        summary = analyse(self.path, starvation=1.0)
+        self.assertEqual(summary['ticks'], 3)
+        self.assertEqual(summary['meals'], 5)
+        self.assertEqual(summary['mealsPerSeat'], [3, 2])
+        self.assertEqual(summary['mealsPerSecond'], 2.0)
+        self.assertEqual(summary['messagesPerMeal'], 2.0)
+        self.assertAlmostEqual(summary['fairness'], 25 / 26)
+        self.assertEqual(summary['tokenHandoffs'], 2)
+        self.assertEqual(summary['longestStarvation'], 2.0)
+        # Gaps of exactly the threshold count as starvation.
+        self.assertEqual(sorted(summary['starvationIntervals']), [[0, 0.5, 1.5], [0, 1.5, 2.5], [1, 0.5, 2.5]])
+
+    def test_counter_reset_counts_as_a_fresh_start(self):
+        self.record([(1.0, {0: status(5)}), (2.0, {}), (3.0, {0: status(2)})], seats=1)
+        summary = analyse(self.path, starvation=10.0)
+        self.assertEqual(summary['mealsPerSeat'], [7])
+        self.assertEqual(summary['starvationIntervals'], [])
+
+    def test_hunger_until_the_end_is_reported(self):
+        self.record([(0.0, {0: status(1)}), (3.0, {0: status(1)})], seats=1)
+        self.assertEqual(analyse(self.path, starvation=3.0)['starvationIntervals'], [[0, 0.0, 3.0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
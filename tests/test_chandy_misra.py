@@ -0,0 +1,67 @@
+import unittest
+
+from chandy_misra import HygienicForks
+
+
+class HygienicForksTest(unittest.TestCase):
+    def setUp(self):
+        self.lower = HygienicForks(1, [2])
+        self.upper = HygienicForks(2, [1])
+
+    def test_lower_seat_starts_with_the_fork(self):
+        self.assertEqual(self.lower.holding(), {2: True})
+        self.assertEqual(self.upper.holding(), {1: False})
+        self.assertTrue(self.lower.acquire(0))
+        self.assertFalse(self.upper.acquire(0))
+
+    def test_dirty_fork_is_handed_over(self):
+        self.assertEqual(self.upper.missing(), [1])
+        self.assertTrue(self.lower.request(2, self.upper.turn(1)))
+        self.upper.receive(1)
+        self.assertTrue(self.upper.acquire(0))
+        self.assertEqual(self.upper.missing(), [])
+
+    def test_request_while_eating_is_deferred(self):
+        self.assertTrue(self.lower.acquire(0))
+        self.assertEqual(self.upper.missing(), [1])
+        self.assertFalse(self.lower.request(2, self.upper.turn(1)))
+        self.assertEqual(self.lower.release(), [2])
+        self.assertEqual(self.lower.holding(), {2: False})
+
+    def test_retried_request_gets_the_same_answer(self):
+        self.upper.missing()
+        turn = self.upper.turn(1)
+        self.assertTrue(self.lower.request(2, turn))
+        self.upper.ask_again(1)
+        self.assertEqual(self.upper.missing(), [1])
+        self.assertEqual(self.upper.turn(1), turn)
+        self.assertTrue(self.lower.request(2, turn))
+
+    def test_new_request_is_not_answered_as_a_retry(self):
+        self.lower.acquire(0)
+        self.upper.missing()
+        turn = self.upper.turn(1)
+        self.assertFalse(self.lower.request(2, turn))
+        self.assertEqual(self.lower.release(), [2])
+        self.upper.receive(1)
+        self.upper.acquire(0)
+        self.upper.release()
+        self.lower.missing()
+        self.assertTrue(self.upper.request(1, self.lower.turn(2)))
+        self.lower.receive(2)
+        self.lower.acquire(0)
+        self.lower.release()
+        self.assertEqual(self.upper.missing(), [1])
+        self.assertNotEqual(self.upper.turn(1), turn)
+        self.assertTrue(self.lower.request(2, self.upper.turn(1)))
+
+
+    def test_early_request_is_served_once_the_neighbour_is_added(self):
+        forks = HygienicForks(1, [])
+        self.assertFalse(forks.request(2, True))
+        forks.add(2)
+        self.assertEqual(forks.reset(), [2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from launcher import batches, parse_host, philosopher_command
+
+
+class BatchesTest(unittest.TestCase):
+    def test_even_split(self):
+        self.assertEqual(batches(6, ['a', 'b', 'c']), [('a', 2), ('b', 2), ('c', 2)])
+
+    def test_first_hosts_take_the_remainder(self):
+        self.assertEqual(batches(7, ['a', 'b', 'c']), [('a', 3), ('b', 2), ('c', 2)])
+
+    def test_every_seat_is_placed(self):
+        for philosophers in range(3, 40):
+            self.assertEqual(sum(count for _, count in batches(philosophers, ['a', 'b', 'c'])), philosophers)
+
+
+class CommandTest(unittest.TestCase):
+    def test_host_advertises_its_bind_address_by_default(self):
+        self.assertEqual(parse_host('10.0.0.1'), ('10.0.0.1', '10.0.0.1'))
+        self.assertEqual(parse_host('0.0.0.0=10.0.0.1'), ('0.0.0.0', '10.0.0.1'))
+
+    def test_remote_prefix(self):
+        command = philosopher_command('ssh {host} cd tp2sd &&', 'python3', ('10.0.0.1', '10.0.0.2'),
+                                      '10.0.0.9:8980', 9000, 4, ['--asyncio'])
+        self.assertEqual(command[:5], ['ssh', '10.0.0.1', 'cd', 'tp2sd', '&&'])
+        self.assertEqual(command[5:7], ['python3', 'philosopher.py'])
+        self.assertEqual(command[-3:], ['--advertise', '10.0.0.2', '--asyncio'])
+
+
+if __name__ == '__main__':
+    unittest.main()
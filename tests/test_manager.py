@@ -0,0 +1,108 @@
+import logging
+import unittest
+from multiprocessing import Queue
+from time import monotonic, sleep
+
+from manager import Server
+from philosopher import ManagerClient, PhilosopherState
+from transport import MemoryTransport
+
+
+class Guest(ManagerClient):
+    def __init__(self, transport, manager_port, port):
+        self.state = PhilosopherState()
+        self.port = port
+        self.silent = False
+        ManagerClient.__init__(self, (MemoryTransport.HOST, manager_port), port, self.state, transport)
+        self.daemon = True
+        self.set_ready(True)
+        self.start()
+
+    def address(self):
+        return None if self.get_pairs() is None else dict(zip(self.get_neighbours(), self.get_pairs()))
+
+    def handle_request(self, request):
+        if self.silent:
+            return None
+        return ManagerClient.handle_request(self, request)
+
+
+def wait_for(predicate, timeout=10.0):
+    deadline = monotonic() + timeout
+    while not predicate():
+        if monotonic() > deadline:
+            raise AssertionError('timed out waiting for the table')
+        sleep(0.02)
+
+
+# A dinner of bare manager clients on the in-memory transport, so seats can leave and be taken again without any
+# philosopher eating in between.
+class ManagerTest(unittest.TestCase):
+    SETTINGS = ['MODE', 'TOPOLOGY', 'TOKENS', 'STATUS_INTERVAL', 'HEARTBEAT_TIMEOUT', 'WAIT_TIMEOUT']
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.saved = dict((name, getattr(Server, name)) for name in ManagerTest.SETTINGS)
+        Server.MODE = 'WITHOUT_TOKEN'
+        Server.TOPOLOGY = 'ring'
+        Server.TOKENS = 1
+        Server.STATUS_INTERVAL = 0
+        Server.HEARTBEAT_TIMEOUT = 0.5
+        Server.WAIT_TIMEOUT = 0.1
+        self.transport = MemoryTransport()
+        self.server = Server(Queue(), 0, 4, None, self.transport)
+        self.server.start()
+        self.guests = [self.join(100 + i) for i in range(4)]
+        self.assertTrue(self.server.wait_start(10))
+        self.seats = dict((guest.state.seat, guest) for guest in self.guests)
+
+    def tearDown(self):
+        self.server.killme()
+        self.server.join()
+        self.server.send_kill_signal()
+        self.server.close()
+        for name, value in self.saved.items():
+            setattr(Server, name, value)
+        logging.disable(logging.NOTSET)
+
+    def join(self, port):
+        return Guest(self.transport, self.server.get_port(), port)
+
+    def ports(self, seat):
+        return sorted(int(address.rsplit(':', 1)[1]) for address in self.seats[seat].address().values())
+
+    def test_every_seat_gets_its_ring_neighbours(self):
+        self.assertEqual(sorted(self.seats), [0, 1, 2, 3])
+        for seat, guest in self.seats.items():
+            self.assertEqual(sorted(guest.get_neighbours()), sorted([(seat - 1) % 4, (seat + 1) % 4]))
+            self.assertTrue(guest.get_begin())
+
+    def test_ring_closes_over_a_seat_that_left(self):
+        self.seats[1].state.time_to_die = True
+        wait_for(lambda: 1 not in self.seats[0].get_neighbours() and 1 not in self.seats[2].get_neighbours())
+        self.assertEqual(sorted(self.seats[0].get_neighbours()), [2, 3])
+        self.assertEqual(sorted(self.seats[2].get_neighbours()), [0, 3])
+
+    def test_silent_seat_is_buried_after_the_deadline(self):
+        self.seats[3].silent = True
+        wait_for(lambda: 3 not in self.seats[0].get_neighbours())
+        self.assertEqual(sorted(self.seats[2].get_neighbours()), [0, 1])
+
+    def test_newcomer_takes_the_empty_seat(self):
+        self.seats[2].state.time_to_die = True
+        wait_for(lambda: 2 not in self.seats[1].get_neighbours())
+        newcomer = self.join(200)
+        wait_for(lambda: newcomer.get_begin())
+        self.assertEqual(newcomer.state.seat, 2)
+        self.assertEqual(sorted(newcomer.get_neighbours()), [1, 3])
+        wait_for(lambda: 200 in self.ports(1) and 200 in self.ports(3))
+
+    def test_newcomer_is_turned_away_from_a_full_table(self):
+        newcomer = self.join(200)
+        sleep(4 * Server.WAIT_TIMEOUT)
+        self.assertIsNone(newcomer.get_pairs())
+        self.assertTrue(all(200 not in self.ports(seat) for seat in self.seats))
+
+
+if __name__ == '__main__':
+    unittest.main()
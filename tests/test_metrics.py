@@ -0,0 +1,45 @@
+import unittest
+from threading import Thread
+
+from metrics import Counter, Histogram, Metrics, prometheus
+
+
+class CounterTest(unittest.TestCase):
+    def test_counter_sums_every_thread(self):
+        counter = Counter()
+        threads = [Thread(target=lambda: [counter.increment() for _ in range(1000)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.increment(5)
+        self.assertEqual(counter.value(), 4005)
+
+
+class HistogramTest(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = Histogram([0.001, 0.01, 0.1])
+        self.assertIsNone(histogram.percentile(0.5))
+        for value in [0.0005] * 98 + [0.05, 1.0]:
+            histogram.observe(value)
+        self.assertEqual(histogram.percentile(0.5), 0.001)
+        self.assertEqual(histogram.percentile(0.99), 0.1)
+        self.assertEqual(histogram.percentile(1.0), float('inf'))
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['p50'], 1.0)
+
+    def test_prometheus_buckets_are_cumulative(self):
+        metrics = Metrics()
+        metrics.counter('meals').increment(3)
+        histogram = metrics.histogram('wait')
+        for value in [0.0001, 0.5]:
+            histogram.observe(value)
+        lines = prometheus([({'seat': 0}, metrics)]).splitlines()
+        self.assertIn('philosopher_meals_total{seat="0"} 3', lines)
+        self.assertIn('philosopher_wait_count{seat="0"} 2', lines)
+        self.assertIn('philosopher_wait_bucket{seat="0",le="+Inf"} 2', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
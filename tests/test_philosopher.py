@@ -0,0 +1,89 @@
+import unittest
+
+from philosopher import ManagerClient, PhilosopherServerConnection, PhilosopherState
+
+
+def seated(seat, neighbours):
+    state = PhilosopherState()
+    state.seat = seat
+    for neighbour in neighbours:
+        state.seat_fork(neighbour)
+    return state
+
+
+class TokenPassTest(unittest.TestCase):
+    def post_token(self, state, turn):
+        request = {'code': 'POST_TOKEN', 'seat': 0, 'turn': turn}
+        return PhilosopherServerConnection.handle_request(state, '127.0.0.1', request)['accepted']
+
+    def test_retried_pass_is_accepted_again(self):
+        state = seated(1, [0, 2])
+        self.assertTrue(self.post_token(state, True))
+        self.assertTrue(self.post_token(state, True))
+        self.assertEqual(state.token, (True, 2))
+
+    def test_new_pass_to_a_holder_is_refused(self):
+        state = seated(1, [0, 2])
+        self.assertTrue(self.post_token(state, True))
+        self.assertFalse(self.post_token(state, False))
+        self.assertFalse(self.post_token(state, False))
+        state.token = (False, None)
+        self.assertTrue(self.post_token(state, True))
+
+    def test_seat_taken_over_starts_over(self):
+        state = seated(1, [0, 2])
+        self.assertTrue(self.post_token(state, True))
+        state.token = (False, None)
+        state.drop_fork(0)
+        state.seat_fork(0)
+        self.assertTrue(self.post_token(state, True))
+
+
+class EarlyForkRequestTest(unittest.TestCase):
+    def test_fork_request_before_the_pairs_goes_unanswered(self):
+        state = PhilosopherState()
+        request = {'code': 'REQUEST_FORK', 'seat': 0, 'turn': True}
+        self.assertIsNone(PhilosopherServerConnection.handle_request(state, '127.0.0.1', request))
+
+    def test_pairs_bring_the_forks_along(self):
+        state = PhilosopherState()
+        client = ManagerClient(('127.0.0.1', 0), 0, state)
+        client.handle_request({'code': 'POST_PAIRS', 'seat': 1, 'pairs': ['127.0.0.1:1'], 'neighbours': [2],
+                               'mode': 'CHANDY_MISRA'})
+        request = {'code': 'REQUEST_FORK', 'seat': 2, 'turn': True}
+        response = PhilosopherServerConnection.handle_request(state, '127.0.0.1', request)
+        self.assertFalse(response['granted'])
+        state.forks.add(2)
+        self.assertEqual(state.forks.reset(), [2])
+
+class HostedForkTest(unittest.TestCase):
+    def setUp(self):
+        self.state = seated(1, [0, 2])
+
+    def test_lower_seat_hosts_the_fork(self):
+        self.assertTrue(self.state.hosts(2))
+        self.assertFalse(self.state.hosts(0))
+        self.assertFalse(self.state.lend_fork(0))
+
+    def test_fork_is_taken_or_lent_never_both(self):
+        self.assertTrue(self.state.take_fork(2))
+        self.assertFalse(self.state.lend_fork(2))
+        self.state.with_fork[2] = False
+        self.assertTrue(self.state.lend_fork(2))
+        self.assertFalse(self.state.take_fork(2))
+        self.state.return_fork(2)
+        self.assertTrue(self.state.take_fork(2))
+
+    def test_lending_again_to_the_holder_is_a_grant(self):
+        self.assertTrue(self.state.lend_fork(2))
+        self.assertTrue(self.state.lend_fork(2))
+
+    def test_dropped_fork_is_forgotten(self):
+        self.state.drop_fork(2)
+        self.assertFalse(self.state.lend_fork(2))
+        self.state.return_fork(2)
+        self.assertEqual(list(self.state.with_fork), [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
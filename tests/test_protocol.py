@@ -0,0 +1,59 @@
+import unittest
+
+from protocol import BINARY_CODES, BINARY_MESSAGE, HEADER, MAX_MESSAGE_SIZE, MessageReader, choose_encoding, \
+    decode_binary, encode_binary, encode_message
+
+
+class FramingTest(unittest.TestCase):
+    def test_reader_splits_and_merges_frames(self):
+        messages = [{'code': 'HELLO', 'encodings': ['json']}, {'code': 'POST_FORK', 'seat': 3},
+                    {'code': 'ACQUIRE_FORK_RESPONSE', 'granted': True, 'state': 'EATING'}]
+        data = b''.join(encode_message(message) for message in messages)
+        reader = MessageReader()
+        for i in range(len(data)):
+            reader.feed(data[i:i + 1])
+        self.assertEqual([reader.next_message() for _ in messages], messages)
+        self.assertIsNone(reader.next_message())
+
+        reader.feed(data + data[:5])
+        self.assertEqual(reader.pending(), len(messages))
+
+    def test_reader_rejects_oversized_frames(self):
+        with self.assertRaises(ValueError):
+            MessageReader().feed(HEADER.pack(MAX_MESSAGE_SIZE + 1))
+
+    def test_frame_is_length_prefixed(self):
+        frame = encode_message({'code': 'POST_BEGIN'})
+        self.assertEqual(HEADER.unpack_from(frame)[0], len(frame) - HEADER.size)
+
+
+class BinaryEncodingTest(unittest.TestCase):
+    def test_round_trip(self):
+        for code, (opcode, flag, value) in BINARY_CODES.items():
+            data = {'code': code}
+            if flag is not None:
+                data[flag] = True
+            if value == 'state':
+                data[value] = 'SLEEPING'
+            elif value is not None:
+                data[value] = 7
+            payload = encode_binary(data)
+            self.assertEqual(len(payload), BINARY_MESSAGE.size)
+            self.assertEqual(decode_binary(payload), data)
+
+    def test_messages_the_binary_encoding_cannot_hold_go_as_json(self):
+        data = {'code': 'POST_FORK', 'seat': 3, 'extra': 1}
+        self.assertIsNone(encode_binary(data))
+        self.assertIsNone(encode_binary({'code': 'ACQUIRE_FORK_RESPONSE', 'granted': True, 'state': 'DEAD'}))
+        self.assertIsNone(encode_binary({'code': 'HELLO', 'encodings': ['binary']}))
+        reader = MessageReader()
+        reader.feed(encode_message(data, 'binary') + encode_message({'code': 'POST_FORK', 'seat': 3}, 'binary'))
+        self.assertEqual([reader.next_message(), reader.next_message()], [data, {'code': 'POST_FORK', 'seat': 3}])
+
+    def test_choose_encoding(self):
+        self.assertEqual(choose_encoding(['binary', 'json'], ['binary', 'json']), 'binary')
+        self.assertEqual(choose_encoding(['msgpack'], ['binary', 'json']), 'json')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from series import HOLDER, PRESENT, open_series, read_series
+
+
+class SeriesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def round_trip(self, name):
+        path = os.path.join(self.directory, name)
+        series = open_series(path, 3)
+        status = {'meals': 4, 'deadlocks': 1, 'messagesSent': 9, 'messagesReceived': 8, 'token': (True, 2)}
+        series.record(0.5, {0: status})
+        series.record(1.0, {0: status, 2: dict(status, token=(False, None))})
+        series.close()
+        return read_series(path)
+
+    def test_binary_round_trip(self):
+        seats, ticks = self.round_trip('dinner.bin')
+        self.assertEqual(seats, 3)
+        self.assertEqual([elapsed for elapsed, rows in ticks], [0.5, 1.0])
+        self.assertEqual(ticks[1][1], [(4, 1, 9, 8, HOLDER), None, (4, 1, 9, 8, PRESENT)])
+
+    def test_csv_round_trip(self):
+        seats, ticks = self.round_trip('dinner.csv')
+        self.assertEqual(seats, 3)
+        self.assertEqual(ticks[0][1], [(4, 1, 9, 8, HOLDER), None, None])
+        self.assertEqual(ticks[1][1][2], (4, 1, 9, 8, PRESENT))
+
+
+if __name__ == '__main__':
+    unittest.main()
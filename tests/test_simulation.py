@@ -0,0 +1,32 @@
+import unittest
+
+from simulation import Simulation
+from topology import Topology
+
+
+def totals(statuses, column):
+    return sum(status[column] for status in statuses)
+
+
+class SimulationTest(unittest.TestCase):
+    def test_equal_seeds_replay_equal_dinners(self):
+        for mode in ['WITHOUT_TOKEN', 'TOKEN', 'CHANDY_MISRA']:
+            runs = [Simulation(Topology.ring(7), mode, 2, seed=3, min_time=0, max_time=3, eat_time=1).run()
+                    for _ in range(2)]
+            self.assertEqual(totals(runs[0], 'meals'), totals(runs[1], 'meals'))
+            self.assertGreater(totals(runs[0], 'meals'), 0)
+
+    def test_forks_held_across_messages_are_contended(self):
+        statuses = Simulation(Topology.ring(20), 'WITHOUT_TOKEN', 2, min_time=0, max_time=2, latency=0.5).run()
+        self.assertGreater(totals(statuses, 'deadlocks'), 0)
+        self.assertGreater(totals(statuses, 'meals'), 0)
+
+    def test_one_token_feeds_one_seat_at_a_time(self):
+        statuses = Simulation(Topology.ring(5), 'TOKEN', 1, min_time=1, max_time=1, latency=0.5).run()
+        self.assertEqual(totals(statuses, 'deadlocks'), 0)
+        self.assertLessEqual(sum(1 for status in statuses if status['token'][0]), 1)
+        self.assertGreater(totals(statuses, 'meals'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
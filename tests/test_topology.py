@@ -0,0 +1,38 @@
+import unittest
+
+from topology import Topology
+
+
+class TopologyTest(unittest.TestCase):
+    def test_ring(self):
+        ring = Topology.ring(5)
+        self.assertTrue(ring.is_ring())
+        self.assertEqual(ring.get_neighbours(0), [4, 1])
+        self.assertEqual(len(list(ring.edges())), 5)
+        self.assertFalse(Topology.ring(2).is_ring())
+
+    def test_ring_closes_over_missing_seats(self):
+        ring = Topology.ring(5).without({1, 3})
+        self.assertEqual(ring.get_neighbours(0), [4, 2])
+        self.assertEqual(ring.get_neighbours(1), [])
+        self.assertEqual(Topology.ring(3).without({0}).get_neighbours(1), [2])
+
+    def test_grid(self):
+        grid = Topology.parse('grid', 6)
+        self.assertEqual(grid.get_neighbours(0), [1, 3])
+        self.assertEqual(grid.get_neighbours(4), [1, 3, 5])
+        self.assertEqual(grid.without({1}).get_neighbours(0), [3])
+        with self.assertRaises(ValueError):
+            Topology.parse('grid:2x2', 6)
+
+    def test_edges(self):
+        topology = Topology.from_edges(3, [(0, 1), (1, 0), (1, 2)])
+        self.assertEqual(list(topology.edges()), [(0, 1), (1, 2)])
+        with self.assertRaises(ValueError):
+            Topology.from_edges(3, [(0, 3)])
+        with self.assertRaises(ValueError):
+            Topology.parse('star', 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
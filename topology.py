@@ -0,0 +1,91 @@
+from math import isqrt
+
+
+class Topology(object):
+    def __init__(self, neighbours, ring=False):
+        self.__neighbours = neighbours
+        self.__ring = ring
+
+    def size(self):
+        return len(self.__neighbours)
+
+    def get_neighbours(self, seat):
+        return self.__neighbours[seat]
+
+    def is_ring(self):
+        size = self.size()
+        return size > 2 and all(self.__neighbours[i] == [(i - 1) % size, (i + 1) % size] for i in range(size))
+
+    def edges(self):
+        for seat, neighbours in enumerate(self.__neighbours):
+            for neighbour in neighbours:
+                if seat < neighbour:
+                    yield seat, neighbour
+
+    def without(self, seats):
+        if not self.__ring:
+            return Topology([[] if seat in seats else [n for n in neighbours if n not in seats]
+                             for seat, neighbours in enumerate(self.__neighbours)])
+        alive = [seat for seat in range(self.size()) if seat not in seats]
+        neighbours = [[] for _ in range(self.size())]
+        if len(alive) == 2:
+            neighbours[alive[0]] = [alive[1]]
+            neighbours[alive[1]] = [alive[0]]
+        elif len(alive) > 2:
+            for i, seat in enumerate(alive):
+                neighbours[seat] = [alive[i - 1], alive[(i + 1) % len(alive)]]
+        return Topology(neighbours)
+
+    @staticmethod
+    def ring(size):
+        if size < 2:
+            return Topology([[] for _ in range(size)])
+        if size == 2:
+            return Topology([[1], [0]], True)
+        return Topology([[(i - 1) % size, (i + 1) % size] for i in range(size)], True)
+
+    @staticmethod
+    def grid(rows, columns):
+        neighbours = []
+        for seat in range(rows * columns):
+            row, column = divmod(seat, columns)
+            seats = []
+            if row > 0:
+                seats.append(seat - columns)
+            if column > 0:
+                seats.append(seat - 1)
+            if column < columns - 1:
+                seats.append(seat + 1)
+            if row < rows - 1:
+                seats.append(seat + columns)
+            neighbours.append(seats)
+        return Topology(neighbours)
+
+    @staticmethod
+    def from_edges(size, edges):
+        neighbours = [[] for _ in range(size)]
+        for a, b in edges:
+            if a == b or not (0 <= a < size and 0 <= b < size):
+                raise ValueError('invalid edge {}-{} for {} seats'.format(a, b, size))
+            if b not in neighbours[a]:
+                neighbours[a].append(b)
+                neighbours[b].append(a)
+        return Topology(neighbours)
+
+    @staticmethod
+    def parse(description, size):
+        if description == 'ring':
+            return Topology.ring(size)
+        if description == 'grid':
+            rows = max(r for r in range(1, isqrt(size) + 1) if size % r == 0)
+            return Topology.grid(rows, size // rows)
+        if description.startswith('grid:'):
+            rows, columns = [int(v) for v in description[len('grid:'):].split('x')]
+            if rows * columns != size:
+                raise ValueError('a {}x{} grid does not seat {} philosophers'.format(rows, columns, size))
+            return Topology.grid(rows, columns)
+        if description.startswith('edges:'):
+            with open(description[len('edges:'):]) as edges_file:
+                edges = [tuple(int(v) for v in line.split()) for line in edges_file if line.strip()]
+            return Topology.from_edges(size, edges)
+        raise ValueError('unknown topology {}'.format(description))
@@ -0,0 +1,140 @@
+import socket
+from itertools import count
+from queue import Empty, SimpleQueue
+from threading import Lock
+
+from protocol import SocketChannel
+
+CLOSED = object()
+
+
+class TcpListener(object):
+    def __init__(self, port, timeout=None, bind=None):
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__socket.bind(("0.0.0.0" if bind is None else bind, port))
+        self.__socket.listen(socket.SOMAXCONN)
+        self.__socket.settimeout(timeout)
+
+    def get_port(self):
+        return self.__socket.getsockname()[1]
+
+    def accept(self):
+        try:
+            con, cliente = self.__socket.accept()
+        except socket.timeout:
+            return None
+        return SocketChannel(con), cliente
+
+    def close(self):
+        self.__socket.close()
+
+
+class TcpTransport(object):
+    NAME = 'tcp'
+
+    def __init__(self, bind=None):
+        self.__bind = bind
+
+    def listen(self, port, timeout=None):
+        return TcpListener(port, timeout, self.__bind)
+
+    def connect(self, address, timeout=None):
+        return SocketChannel.connect(address, timeout, self.__bind)
+
+
+class MemoryChannel(object):
+    def __init__(self, inbox, outbox, closed, peer, timeout=None):
+        self.__inbox = inbox
+        self.__outbox = outbox
+        self.__closed = closed
+        self.__peer = peer
+        self.__timeout = timeout
+
+    def get_peer(self):
+        return self.__peer
+
+    def set_encoding(self, encoding):
+        pass
+
+    def send(self, data):
+        if self.__closed[0]:
+            raise ConnectionError('connection closed by peer')
+        self.__outbox.put(data)
+
+    def read(self):
+        try:
+            data = self.__inbox.get(timeout=self.__timeout)
+        except Empty:
+            raise TimeoutError('no message from {}:{}'.format(self.__peer[0], self.__peer[1]))
+        if data is CLOSED:
+            self.__inbox.put(CLOSED)
+            raise ConnectionError('connection closed by peer')
+        return data
+
+    def close(self):
+        self.__closed[0] = True
+        self.__inbox.put(CLOSED)
+        self.__outbox.put(CLOSED)
+
+
+class MemoryListener(object):
+    def __init__(self, transport, port, timeout=None):
+        self.__transport = transport
+        self.__port = port
+        self.__timeout = timeout
+        self.__accepted = SimpleQueue()
+
+    def get_port(self):
+        return self.__port
+
+    def push(self, channel, cliente):
+        self.__accepted.put((channel, cliente))
+
+    def accept(self):
+        try:
+            return self.__accepted.get(timeout=self.__timeout)
+        except Empty:
+            return None
+
+    def close(self):
+        self.__transport.unlisten(self.__port)
+
+
+class MemoryTransport(object):
+    NAME = 'memory'
+    HOST = 'memory'
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__listeners = {}
+        self.__ports = count(1)
+        self.__clients = count(1)
+
+    def listen(self, port, timeout=None):
+        with self.__lock:
+            if port == 0:
+                port = next(port for port in self.__ports if port not in self.__listeners)
+            if port in self.__listeners:
+                raise OSError('port {} is already in use'.format(port))
+            self.__listeners[port] = MemoryListener(self, port, timeout)
+            return self.__listeners[port]
+
+    def unlisten(self, port):
+        with self.__lock:
+            self.__listeners.pop(port, None)
+
+    def connect(self, address, timeout=None):
+        with self.__lock:
+            listener = self.__listeners.get(address[1])
+            client = next(self.__clients)
+        if listener is None:
+            raise ConnectionRefusedError('nothing listens on {}:{}'.format(address[0], address[1]))
+        requests = SimpleQueue()
+        responses = SimpleQueue()
+        closed = [False]
+        listener.push(MemoryChannel(requests, responses, closed, (MemoryTransport.HOST, client)),
+                      (MemoryTransport.HOST, client))
+        return MemoryChannel(responses, requests, closed, (MemoryTransport.HOST, address[1]), timeout)
+
+
+TRANSPORTS = {TcpTransport.NAME: TcpTransport, MemoryTransport.NAME: MemoryTransport}